@@ -0,0 +1,1258 @@
+"""
+Core computations for the walkability analysis, shared by the Streamlit app
+(through data_handler.py) and the batch scripts.
+
+Nothing here imports Streamlit or Altair, and nothing reads session state:
+every function takes a dataset and/or a region and returns a result, so the
+same code runs in the app, in build scripts and in forked worker processes.
+pyarrow is only imported when a Parquet file is actually read.
+
+Loaders raise on database errors; the Streamlit wrappers in data_handler.py
+turn those into st.error messages.
+"""
+
+import bisect
+import functools
+import heapq
+import logging
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import build_manifest
+from config import derived_fields, field_dict, fields
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'data/nwi_full_2019_complete.db'
+# Columnar export of the block group rows, written by build_dataset.py
+SNAPSHOT_PATH = 'data/nwi_block_groups.parquet'
+# Region x NWI level sums, written by generate_summary_tables.py
+CUBE_PATH = 'data/region_cube.parquet'
+# One row per region (type, name, state, size), written by generate_summary_tables.py
+REGIONS_PATH = 'data/region_dimension.parquet'
+# Ranked summary tables for the Tables page, written by generate_summary_tables.py
+summary_names = {"State": "states", "County": "counties", "CSA": "csas", "City": "cities"}
+# Generated files in data/ whose inputs are tracked in the build manifest
+artifact_names = [
+    os.path.basename(SNAPSHOT_PATH),
+    os.path.basename(CUBE_PATH),
+    os.path.basename(REGIONS_PATH),
+] + [f"summary_{plural}.parquet" for plural in summary_names.values()]
+
+region_types = ["National", "State", "County", "CSA", "City"]
+
+# Columns that are stored as TEXT in nwi_full but hold numbers
+field_columns = [field.lower() for field in fields]
+numeric_columns = field_columns + ["nwi", "nwi_scaled_10", "natwalkind"]
+# Columns computed from other columns (lowercase) -> config.derived_fields definition
+derived_columns = {name.lower(): spec for name, spec in derived_fields.items()}
+
+# Columns the charts and tables use besides config.fields; the loaders read
+# only these plus the field columns unless asked for something else
+key_columns = [
+    "geoid10", "geography_type", "state_name", "county_name", "csa_name", "city_name",
+    "nwi", "nwi_scaled_10", "natwalkind",
+]
+default_columns = tuple(key_columns + field_columns + [c for c in derived_columns if c not in field_columns])
+
+# String columns stored as pandas categoricals by compact_frame
+category_columns = ["geography_type", "state_name", "county_name", "csa_name", "city_name"]
+
+# Mapping NWI levels to the short labels used as summary table columns
+nwi_to_label_map = {
+    0: "1-Least",
+    1: "2-Below Avg",
+    2: "3-Above Avg",
+    3: "4-Most",
+}
+
+# Full NWI level names used on the population chart
+nwi_level_names = {
+    0: "1 - Least Walkable",
+    1: "2 - Below Average",
+    2: "3 - Above Average",
+    3: "4 - Most Walkable",
+}
+
+# Fix missing state names using FIPS codes from geoid10
+state_fips_to_name = {
+    '01': 'Alabama', '02': 'Alaska', '04': 'Arizona', '05': 'Arkansas', '06': 'California',
+    '08': 'Colorado', '09': 'Connecticut', '10': 'Delaware', '11': 'District of Columbia',
+    '12': 'Florida', '13': 'Georgia', '15': 'Hawaii', '16': 'Idaho', '17': 'Illinois',
+    '18': 'Indiana', '19': 'Iowa', '20': 'Kansas', '21': 'Kentucky', '22': 'Louisiana',
+    '23': 'Maine', '24': 'Maryland', '25': 'Massachusetts', '26': 'Michigan', '27': 'Minnesota',
+    '28': 'Mississippi', '29': 'Missouri', '30': 'Montana', '31': 'Nebraska', '32': 'Nevada',
+    '33': 'New Hampshire', '34': 'New Jersey', '35': 'New Mexico', '36': 'New York',
+    '37': 'North Carolina', '38': 'North Dakota', '39': 'Ohio', '40': 'Oklahoma',
+    '41': 'Oregon', '42': 'Pennsylvania', '44': 'Rhode Island', '45': 'South Carolina',
+    '46': 'South Dakota', '47': 'Tennessee', '48': 'Texas', '49': 'Utah', '50': 'Vermont',
+    '51': 'Virginia', '53': 'Washington', '54': 'West Virginia', '55': 'Wisconsin',
+    '56': 'Wyoming', '72': 'Puerto Rico'
+}
+
+
+# ----------------------------- Build artifacts -----------------------------
+
+@functools.lru_cache(maxsize=None)
+def stale_artifacts():
+    """Check the build manifest once per process; returns {artifact: reason} for stale ones"""
+    manifest = build_manifest.read_manifest()
+    recorded = [name for name in artifact_names if name in manifest.get("artifacts", {})]
+    for name in artifact_names:
+        if name not in recorded and os.path.exists(os.path.join("data", name)):
+            logger.warning("data/%s has no build manifest record, so it cannot be checked for staleness", name)
+    if not recorded:
+        # Nothing to compare against, so don't read the whole table to fingerprint it
+        return {}
+    snapshot = os.path.basename(SNAPSHOT_PATH)
+    others = [name for name in recorded if name != snapshot]
+    try:
+        inputs = build_manifest.current_inputs(DB_PATH, manifest)
+        stale = build_manifest.stale_artifacts([name for name in recorded if name == snapshot], inputs, manifest)
+        if others:
+            # The other artifacts' values also depend on the classify_nwi method:
+            # the one recorded with a current snapshot, else read from the database
+            method = None
+            if snapshot in recorded and snapshot not in stale:
+                method = build_manifest.artifact_details(snapshot, "nwi_classification", manifest)
+            method = method or database_nwi_method()
+            stale.update(build_manifest.stale_artifacts(others, dict(inputs, nwi_classification=method), manifest))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Could not fingerprint %s: %s", DB_PATH, e)
+        return {}
+    for name, reason in stale.items():
+        logger.warning("Not serving data/%s: %s. Rerun build_dataset.py / generate_summary_tables.py.", name, reason)
+    return stale
+
+
+def artifact_available(path):
+    """True if a generated file exists and was built from the current inputs"""
+    return os.path.exists(path) and os.path.basename(path) not in stale_artifacts()
+
+
+# ------------------------------- SQLite reads -------------------------------
+
+def connect_readonly(db_path=DB_PATH):
+    """Open the database read-only with pragmas tuned for the app's read path"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    # Map the file into memory instead of copying pages through read() calls
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def region_filter_sql(region_type, region_name):
+    """WHERE clause and params selecting one region's block groups in nwi_full.
+
+    Returns (None, None) for an unknown region type. index_database.py builds
+    indexes that match each of these filters.
+    """
+    if region_type == "National":
+        # For national, we still need all data, but this is explicit
+        return "geography_type = 'block_group'", []
+    elif region_type == "State":
+        return "geography_type = 'block_group' AND state_name = ?", [region_name]
+    elif region_type == "County":
+        return "geography_type = 'block_group' AND county_name = ?", [region_name]
+    elif region_type == "CSA":
+        return "geography_type = 'block_group' AND csa_name = ?", [region_name]
+    elif region_type == "City":
+        # Handle "City, State" format - extract city and state
+        if ', ' in region_name:
+            city_name, state_name = region_name.split(', ', 1)
+            return "geography_type = 'block_group' AND city_name = ? AND state_name = ?", [city_name, state_name]
+        # Fallback for just city name
+        return "geography_type = 'block_group' AND city_name = ?", [region_name]
+    return None, None
+
+
+def _select_list(conn, columns):
+    """SELECT list for the requested columns that nwi_full has or can derive (None = all)
+
+    config.derived_fields columns are computed by the query, since only the
+    snapshot stores them.
+    """
+    table_columns = [row[1] for row in conn.execute("PRAGMA table_info(nwi_full)")]
+    if columns is None:
+        columns = table_columns + [column for column in derived_columns if column not in table_columns]
+    available = set(table_columns)
+    selected = []
+    for column in columns:
+        if column in derived_columns:
+            if all(name in available for name in derived_inputs(column)):
+                selected.append(f'{derived_field_sql(column)} AS "{column}"')
+        elif column in available:
+            selected.append(f'"{column}"')
+    return ", ".join(selected)
+
+
+def _read_region_sql(region_type, region_name, columns=default_columns):
+    """Fallback when no snapshot has been built: query the SQLite table directly"""
+    where, params = region_filter_sql(region_type, region_name)
+    if where is None:
+        return None
+    with connect_readonly() as conn:
+        return pd.read_sql(
+            f"SELECT {_select_list(conn, columns)} FROM nwi_full WHERE {where}", conn, params=params
+        )
+
+
+# region_lists() key for each region type in the region dimension
+region_list_keys = {"State": "states", "County": "counties", "CSA": "csas", "City": "cities"}
+
+
+def collapse_region_states(pairs):
+    """One region dimension row per (region_type, region) from per-state counts.
+
+    pairs has region_type, region, state, block_groups and population for
+    every state a region has block groups in. The counts are summed and the
+    region's state is the one holding most of its block groups (regions such
+    as CSAs can cross state lines).
+    """
+    pairs = pairs.sort_values(["region_type", "region", "block_groups"], ascending=[True, True, False], kind="stable")
+    dimension = pairs.groupby(["region_type", "region"], sort=True).agg(
+        state=("state", "first"),
+        block_groups=("block_groups", "sum"),
+        population=("population", "sum"),
+    ).reset_index()
+    dimension["block_groups"] = dimension["block_groups"].astype(np.int64)
+    return dimension
+
+
+def _region_dimension_sql():
+    """Region dimension computed with GROUP BY queries, for when it hasn't been built"""
+    keys = {
+        "State": ("state_name", "state_name IS NOT NULL"),
+        "County": ("county_name", "county_name IS NOT NULL"),
+        "CSA": ("csa_name", "csa_name IS NOT NULL"),
+        "City": ("city_name || ', ' || state_name", "city_name IS NOT NULL AND state_name IS NOT NULL"),
+    }
+    parts = []
+    with connect_readonly() as conn:
+        for region_type, (expression, condition) in keys.items():
+            parts.append(pd.read_sql(f"""
+                SELECT ? AS region_type, {expression} AS region, state_name AS state,
+                COUNT(*) AS block_groups, SUM(CAST(b02001_001e AS REAL)) AS population
+                FROM nwi_full
+                WHERE geography_type = 'block_group' AND {condition}
+                GROUP BY 2, 3
+            """, conn, params=[region_type]))
+    return collapse_region_states(pd.concat(parts, ignore_index=True))
+
+
+@functools.lru_cache(maxsize=None)
+def region_dimension():
+    """Every State/County/CSA/City region with its state, block group count and population.
+
+    Region names are the ones the dropdowns show ("City, State" for cities).
+    Read from the table generate_summary_tables.py builds; if it hasn't been
+    built, computed from the database (which scans the whole table).
+    """
+    if artifact_available(REGIONS_PATH):
+        return pd.read_parquet(REGIONS_PATH)
+    return _region_dimension_sql()
+
+
+def region_lists():
+    """Region names for each dropdown: states, counties, CSAs and "City, State" cities"""
+    dimension = region_dimension()
+    return {
+        key: sorted(dimension.loc[dimension["region_type"] == region_type, "region"])
+        for region_type, key in region_list_keys.items()
+    }
+
+
+def region_states(region_type):
+    """Map of region name -> its state for one region type"""
+    dimension = region_dimension()
+    regions = dimension[dimension["region_type"] == region_type]
+    return dict(zip(regions["region"], regions["state"]))
+
+
+def _normalize_name(name):
+    """Lowercase name with punctuation turned into single spaces"""
+    return " ".join("".join(c if c.isalnum() else " " for c in name.lower()).split())
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RegionSearchIndex:
+    """Type-ahead search over region names.
+
+    A query matches, best first: names starting with it, names with a later
+    word starting with it (so "texas" finds every Texas city), then names
+    sharing enough character trigrams with it to survive typos ("austn texs").
+    Queries shorter than short_query characters have too few trigrams to
+    reach min_similarity against a long name ("bostn" vs "boston
+    massachusetts"), so they take the names sharing the most trigrams
+    regardless.
+    Case and punctuation are ignored and ties go to the more populous region.
+    Prefix lookups are binary searches over sorted keys, and the fuzzy pass
+    only scores names that share a trigram with the query.
+    """
+
+    # Queries shorter than this skip the fuzzy similarity threshold
+    short_query = 6
+
+    def __init__(self, names, populations=None):
+        self.names = list(names)
+        self.populations = list(populations) if populations is not None else [0] * len(self.names)
+        normalized = [_normalize_name(name) for name in self.names]
+        self._gram_counts = [len(_trigrams(text)) for text in normalized]
+        self._full = sorted((text, i) for i, text in enumerate(normalized))
+        self._full_keys = [text for text, _ in self._full]
+        self._words = sorted(
+            (text[start:], i)
+            for i, text in enumerate(normalized)
+            for start in [0] + [pos + 1 for pos, c in enumerate(text) if c == " "]
+        )
+        self._word_keys = [text for text, _ in self._words]
+        self._grams = {}
+        for i, text in enumerate(normalized):
+            for gram in _trigrams(text):
+                self._grams.setdefault(gram, []).append(i)
+        self._by_population = sorted(range(len(self.names)), key=lambda i: (-self.populations[i], self.names[i]))
+
+    @staticmethod
+    def _prefixed(keys, entries, prefix):
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff")
+        return {i for _, i in entries[start:end]}
+
+    def search(self, query, k=10, min_similarity=0.3):
+        """Up to k region names for a partial query (the largest regions for an empty one)"""
+        text = _normalize_name(query or "")
+        if not text:
+            return [self.names[i] for i in self._by_population[:k]]
+
+        def popular_first(ids, count):
+            return heapq.nsmallest(count, ids, key=lambda i: (-self.populations[i], self.names[i]))
+
+        starts = self._prefixed(self._full_keys, self._full, text)
+        results = popular_first(starts, k)
+        if len(results) < k:
+            words = self._prefixed(self._word_keys, self._words, text) - starts
+            results += popular_first(words, k - len(results))
+        if len(results) < k:
+            # Fuzzy: Dice similarity of character trigrams. A short query is
+            # ranked by how many of its trigrams a name has instead, since Dice
+            # would favour short names over more populous, longer ones
+            short = len(text) < self.short_query
+            query_grams = _trigrams(text)
+            shared = {}
+            for gram in query_grams:
+                for i in self._grams.get(gram, ()):
+                    shared[i] = shared.get(i, 0) + 1
+            seen = set(results)
+            scored = []
+            for i, count in shared.items():
+                if i in seen:
+                    continue
+                if short:
+                    scored.append((-count, -self.populations[i], self.names[i], i))
+                    continue
+                similarity = 2 * count / (len(query_grams) + self._gram_counts[i])
+                if similarity >= min_similarity:
+                    scored.append((-similarity, -self.populations[i], self.names[i], i))
+            results += [i for *_, i in sorted(scored)]
+        return [self.names[i] for i in results[:k]]
+
+
+def region_search_index(region_type):
+    """RegionSearchIndex over one region type's names, ranked by population"""
+    dimension = region_dimension()
+    regions = dimension[dimension["region_type"] == region_type]
+    return RegionSearchIndex(regions["region"], regions["population"].fillna(0))
+
+
+def city_names():
+    """Available "City, State" names from block group data"""
+    return region_lists()["cities"]
+
+
+# ------------------------------ Column types -------------------------------
+
+def normalize_types(df, columns=numeric_columns):
+    """Cast the ACS and NWI columns to int/float dtypes in place.
+
+    Returns a dict of column -> count of non-empty values that failed to parse
+    (those become NaN). Counts that parse to whole numbers with no gaps are
+    stored as int64, everything else as float64.
+    """
+    failures = {}
+    for column in columns:
+        if column not in df.columns or pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        raw = df[column]
+        values = pd.to_numeric(raw, errors="coerce")
+        failed = values.isna() & raw.notna() & (raw.astype(str).str.strip() != "")
+        if failed.any():
+            failures[column] = int(failed.sum())
+        if values.notna().all() and (values % 1 == 0).all():
+            values = values.astype("int64")
+        else:
+            values = values.astype("float64")
+        df[column] = values
+    return failures
+
+
+def _smallest_int_dtype(values, nullable):
+    """Name of the smallest integer dtype holding every value (pandas nullable one if nullable)"""
+    low, high = values.min(), values.max()
+    candidates = ["uint8", "uint16", "uint32"] if low >= 0 else ["int8", "int16", "int32"]
+    name = "int64"
+    for candidate in candidates:
+        info = np.iinfo(candidate)
+        if info.min <= low and high <= info.max:
+            name = candidate
+            break
+    if nullable:
+        # The masked equivalents are spelled "UInt16" / "Int16"
+        return "UInt" + name[4:] if name.startswith("u") else "Int" + name[3:]
+    return name
+
+
+def compact_frame(df):
+    """Shrink a loaded block-group frame in place and return it.
+
+    Region names become categoricals, whole-number ACS counts use the smallest
+    integer dtype that fits (a nullable one when values are missing, so sums
+    stay exact), nwi and NWI Level become int8 and nwi_scaled_10 float32.
+    """
+    for column in category_columns:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    for column in field_columns:
+        if column not in df.columns or not pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        values = df[column]
+        present = values.dropna()
+        if present.empty or not (present % 1 == 0).all():
+            continue
+        df[column] = values.astype(_smallest_int_dtype(present, values.isna().any()))
+    for column in ("nwi", "NWI Level"):
+        if column in df.columns:
+            df[column] = df[column].astype("Int8" if df[column].isna().any() else np.int8)
+    if "nwi_scaled_10" in df.columns:
+        df["nwi_scaled_10"] = df["nwi_scaled_10"].astype(np.float32)
+    return df
+
+
+def memory_report(df):
+    """Bytes used by each column (largest first) plus a "Total" entry"""
+    usage = df.memory_usage(deep=True, index=False).sort_values(ascending=False)
+    usage["Total"] = usage.sum()
+    return usage
+
+
+def state_names_from_fips(geoid):
+    """Full state names looked up from the first two digits of geoid10"""
+    return geoid.str[:2].map(state_fips_to_name)
+
+
+# Words in a derived field definition that aren't column names
+_expression_keywords = {"and", "or", "not"}
+
+
+def derived_inputs(column):
+    """Lowercase names of the columns a derived column is computed from"""
+    spec = derived_columns[column]
+    names = (name.lower() for name in re.findall(r"[A-Za-z_]\w*", f"{spec['expression']} {spec['condition']}"))
+    return list(dict.fromkeys(name for name in names if name not in _expression_keywords))
+
+
+def add_derived_fields(df):
+    """Compute every config.derived_fields column whose inputs df has, in place.
+
+    The dataset build runs this once and stores the results, so loaders and
+    aggregates read them like any other column.
+    """
+    for column, spec in derived_columns.items():
+        inputs = derived_inputs(column)
+        if not all(name in df.columns for name in inputs):
+            continue
+        values = pd.DataFrame({name: pd.to_numeric(df[name], errors="coerce").fillna(0) for name in inputs})
+        result = values.eval(spec["expression"].lower())
+        df[column] = result.where(values.eval(spec["condition"].lower()), 0)
+    return df
+
+
+def derived_field_sql(column):
+    """SQL expression computing a derived column from the TEXT columns of nwi_full"""
+    spec = derived_columns[column]
+
+    def to_sql(text):
+        return re.sub(
+            r"[A-Za-z_]\w*",
+            lambda m: m.group(0) if m.group(0).lower() in _expression_keywords
+            else f"COALESCE(CAST({m.group(0).lower()} AS REAL), 0)",
+            text,
+        )
+    return f"CASE WHEN {to_sql(spec['condition'])} THEN {to_sql(spec['expression'])} ELSE 0 END"
+
+
+def nwi_classification_method(df):
+    """How classify_nwi assigns df's NWI levels ("nwi" or "natwalkind quartiles")"""
+    return "natwalkind quartiles" if df["nwi"].isnull().all() else "nwi"
+
+
+def database_nwi_method(db_path=DB_PATH):
+    """nwi_classification_method() of the database's block groups, read up to the first numeric nwi"""
+    with connect_readonly(db_path) as conn:
+        cursor = conn.execute("""
+            SELECT nwi FROM nwi_full
+            WHERE geography_type = 'block_group' AND nwi IS NOT NULL
+        """)
+        while rows := cursor.fetchmany(10000):
+            if pd.to_numeric(pd.Series([row[0] for row in rows]), errors="coerce").notna().any():
+                return "nwi"
+    return "natwalkind quartiles"
+
+
+def nwi_method():
+    """How classify_nwi classifies the current data: as recorded with the snapshot, else read from the database"""
+    return snapshot_nwi_method() or database_nwi_method()
+
+
+@functools.lru_cache(maxsize=None)
+def snapshot_nwi_method():
+    """NWI classification build_dataset.py stored in the snapshot, or None if it isn't classified"""
+    if not artifact_available(SNAPSHOT_PATH):
+        return None
+    return build_manifest.artifact_details(os.path.basename(SNAPSHOT_PATH), "nwi_classification")
+
+
+def natwalkind_quartiles(natwalkind):
+    """The 25th, 50th and 75th percentiles of natwalkind that classify_nwi falls back to"""
+    return tuple(natwalkind.quantile([0.25, 0.5, 0.75]))
+
+
+def nwi_from_quartiles(natwalkind, quartiles):
+    """NWI levels (0-3, int8) by natwalkind quartile; 3 where natwalkind is missing"""
+    q1, q2, q3 = quartiles
+    conditions = [
+        natwalkind <= q1,
+        (natwalkind > q1) & (natwalkind <= q2),
+        (natwalkind > q2) & (natwalkind <= q3),
+        natwalkind > q3
+    ]
+    choices = [0, 1, 2, 3]
+    return np.select(conditions, choices, default=3).astype(np.int8)
+
+
+def classify_nwi(df):
+    """Fill in NWI levels in place: natwalkind quartiles if nwi is entirely missing, else missing -> 3.
+
+    build_dataset.py applies this to the whole table once and stores the
+    int8 levels in the snapshot; it only runs at load time without one.
+    Subsets of the table are classified with nwi_levels() instead, so the
+    quartiles are always those of the whole table.
+    """
+    if df["nwi"].isnull().all():
+        df["nwi"] = nwi_from_quartiles(df["natwalkind"], natwalkind_quartiles(df["natwalkind"]))
+    else:
+        df["nwi"] = df["nwi"].fillna(3).astype(np.int8)
+    df["NWI Level"] = (df["nwi"] + 1).astype(np.int8)
+    return df
+
+
+@functools.lru_cache(maxsize=None)
+def table_nwi_quartiles():
+    """natwalkind quartiles of the whole table if classify_nwi uses them (nwi entirely missing), else None"""
+    method = snapshot_nwi_method()
+    if method == "nwi":
+        return None
+    df = load_region_frame("National", None, columns=["nwi", "natwalkind"], compact=False)
+    if method is None and (df.empty or not df["nwi"].isnull().all()):
+        return None
+    return natwalkind_quartiles(df["natwalkind"])
+
+
+def nwi_levels(df):
+    """Each block group's NWI level (0-3) by the classify_nwi rule applied to the whole table.
+
+    Frames that are already classified (integer nwi) are returned as is.
+    """
+    if pd.api.types.is_integer_dtype(df["nwi"]):
+        return df["nwi"]
+    quartiles = table_nwi_quartiles()
+    if quartiles is not None:
+        return pd.Series(nwi_from_quartiles(df["natwalkind"], quartiles), index=df.index, name="nwi")
+    return df["nwi"].fillna(3).astype(np.int8)
+
+
+def nwi_level_sql():
+    """SQL expression for a block group's NWI level by the classify_nwi rule (see nwi_levels)"""
+    quartiles = table_nwi_quartiles()
+    if quartiles is None:
+        return "CAST(COALESCE(nwi, 3) AS INTEGER)"
+    # A missing quartile (no natwalkind at all) compares as NULL, so every row falls to level 3
+    q1, q2, q3 = ("NULL" if np.isnan(q) else repr(float(q)) for q in quartiles)
+    natwalkind = "CAST(natwalkind AS REAL)"
+    return (
+        f"CASE WHEN {natwalkind} <= {q1} THEN 0 WHEN {natwalkind} <= {q2} THEN 1 "
+        f"WHEN {natwalkind} <= {q3} THEN 2 ELSE 3 END"
+    )
+
+
+# ---------------------------- Block group loads ----------------------------
+
+def snapshot_filters(region_type, region_name):
+    """Translate a region selection into parquet row filters (None = no filter)"""
+    if region_type == "National":
+        return None
+    elif region_type == "State":
+        return [("state_name", "==", region_name)]
+    elif region_type == "County":
+        return [("county_name", "==", region_name)]
+    elif region_type == "CSA":
+        return [("csa_name", "==", region_name)]
+    elif region_type == "City":
+        # Handle "City, State" format - extract city and state
+        if ', ' in region_name:
+            city_name, state_name = region_name.split(', ', 1)
+            return [("city_name", "==", city_name), ("state_name", "==", state_name)]
+        return [("city_name", "==", region_name)]
+    raise ValueError(f"Unknown region type: {region_type}")
+
+
+def load_snapshot(filters=None, columns=default_columns):
+    """Read block group rows from the columnar snapshot instead of SQLite.
+
+    Only the requested columns that exist in the snapshot are decoded
+    (None = all columns).
+    """
+    if columns is not None:
+        import pyarrow.parquet as pq
+
+        available = set(pq.read_schema(SNAPSHOT_PATH).names)
+        columns = [column for column in columns if column in available]
+    return pd.read_parquet(SNAPSHOT_PATH, filters=filters, columns=columns)
+
+
+def load_region_frame(region_type, region_name, columns=default_columns, compact=True):
+    """Load data for a specific region only.
+
+    columns limits what is read from the snapshot/SQLite; the default is the
+    config.fields columns plus key_columns, None reads every column. With
+    compact the frame is shrunk by compact_frame (batch jobs that need exact
+    float64 inputs pass compact=False). An unknown region type gives an empty
+    frame.
+    """
+    if region_type not in region_types:
+        return pd.DataFrame()
+    if artifact_available(SNAPSHOT_PATH):
+        df = load_snapshot(snapshot_filters(region_type, region_name), columns)
+    else:
+        df = _read_region_sql(region_type, region_name, columns)
+        normalize_types(df)
+
+    # Add NWI Level column that the visualization functions expect
+    if not df.empty:
+        df = df.copy()
+        if pd.api.types.is_integer_dtype(df["nwi"]):
+            # Classified when the snapshot was built
+            df["NWI Level"] = (df["nwi"] + 1).astype(np.int8)
+        else:
+            df["NWI Level"] = df["nwi"].map({0: 1, 1: 2, 2: 3, 3: 4})
+
+    if compact:
+        compact_frame(df)
+        logger.info(
+            "Loaded %s %s: %d rows, %.1f MB", region_type, region_name or "",
+            len(df), memory_report(df)["Total"] / 1e6,
+        )
+    return df
+
+
+def load_block_groups(columns=default_columns):
+    """Every block group, with state names standardized from geoid10 (columns as in load_region_frame)"""
+    if artifact_available(SNAPSHOT_PATH):
+        df = load_snapshot(columns=columns)
+    else:
+        with connect_readonly() as conn:
+            # Load only block group data for city aggregation
+            df = pd.read_sql(f"""
+                SELECT {_select_list(conn, columns)} FROM nwi_full
+                WHERE geography_type = 'block_group'
+            """, conn)
+        normalize_types(df)
+
+    # Standardize all state names using FIPS codes (replaces abbreviations and fills missing values)
+    df['state_name'] = state_names_from_fips(df['geoid10'])
+    return df
+
+
+def load_dataset(compact=True):
+    """National block group frame with NWI levels filled in (compact as in load_region_frame)"""
+    df = load_region_frame("National", None, compact=False)
+    if snapshot_nwi_method() is None:
+        # Read from SQLite (or a snapshot built before the levels were stored);
+        # classified before compacting so the quartiles match table_nwi_quartiles()
+        classify_nwi(df)
+    if compact:
+        compact_frame(df)
+        logger.info("Loaded the national dataset: %d rows, %.1f MB", len(df), memory_report(df)["Total"] / 1e6)
+    return df
+
+
+def region_positions(dataset, region_type, region_name):
+    """Positions of a region's block groups in dataset"""
+    mask = np.ones(len(dataset), dtype=bool)
+    for column, _, value in snapshot_filters(region_type, region_name) or []:
+        mask &= (dataset[column] == value).to_numpy(dtype=bool, na_value=False)
+    return np.flatnonzero(mask)
+
+
+class FieldArrays:
+    """Integer codes over a block group frame, for grouped sums without groupby.
+
+    The NWI level is held as an integer code per row and each region column
+    as integer codes factorized once and reused. A sum over (region x NWI
+    level x column) is then one np.bincount per column on the combined codes
+    instead of a pandas groupby on strings. The column values are read from
+    the frame (compact dtypes and all) on each call rather than copied, so
+    the codes are all this keeps besides the frame. Build one over the
+    shared dataset and keep it; rows arguments are positions in that frame.
+
+    Block groups without an NWI level are left out of the per-level sums, as
+    groupby leaves them out, but still count toward region_totals().
+    """
+
+    def __init__(self, df, columns=None):
+        self.df = df
+        self.columns = [column for column in (field_columns if columns is None else columns) if column in df.columns]
+        nwi = _column_values(df, "nwi", None)
+        self.levels = np.where(np.isnan(nwi), -1, nwi).astype(np.intp)
+        self._codes = {}
+
+    def region_codes(self, region_column):
+        """(code per row, -1 where the region is missing; sorted region names)"""
+        if region_column not in self._codes:
+            self._codes[region_column] = pd.factorize(self.df[region_column], sort=True)
+        return self._codes[region_column]
+
+    def _groups(self, region_column, rows):
+        """Region code per selected row and the region names (one unnamed group if region_column is None)"""
+        if region_column is None:
+            count = len(self.df) if rows is None else len(rows)
+            return np.zeros(count, dtype=np.intp), None
+        codes, regions = self.region_codes(region_column)
+        return (codes if rows is None else codes[rows]), regions
+
+    def level_sums(self, region_column=None, rows=None, columns=None):
+        """Per-(region, NWI level) block group counts and column sums.
+
+        Returns (regions, counts, sums): the sorted region names (None without
+        a region_column, which sums everything as one region), counts shaped
+        (regions, 4) and sums shaped (regions, 4, columns).
+        """
+        codes, regions = self._groups(region_column, rows)
+        levels = self.levels if rows is None else self.levels[rows]
+        size = (1 if regions is None else len(regions)) * 4
+        keep = (codes >= 0) & (levels >= 0)
+        index = (codes * 4 + levels)[keep]
+        positions = np.flatnonzero(keep) if rows is None else np.asarray(rows)[keep]
+        if rows is None and keep.all():
+            positions = None
+
+        columns = self.columns if columns is None else columns
+        sums = np.empty((size, len(columns)))
+        for k, column in enumerate(columns):
+            sums[:, k] = np.bincount(index, self._weights(column, positions), minlength=size)
+        counts = np.bincount(index, minlength=size)
+        return regions, counts.reshape(-1, 4), sums.reshape(-1, 4, len(columns))
+
+    def _weights(self, column, positions):
+        """One column's values at positions (None = all) in its own numeric dtype, missing as 0"""
+        values = self.df[column].array
+        if positions is not None:
+            values = values.take(positions)
+        # Converting a compact column to float64 costs several times more than bincount's own cast
+        return values.to_numpy(dtype=getattr(values.dtype, "numpy_dtype", None), na_value=0)
+
+    def region_totals(self, region_column, weights, rows=None):
+        """Sum of weights (one value per selected row, missing as 0) per region"""
+        codes, regions = self._groups(region_column, rows)
+        keep = codes >= 0
+        return np.bincount(codes[keep], np.nan_to_num(weights)[keep], minlength=len(regions))
+
+
+def group_by_region(df, region_type, region, arrays=None, rows=None):
+    """Sums of the ACS ("b...") columns per NWI level.
+
+    arrays is a FieldArrays over df to reuse, rows positions in df (None = all).
+    """
+    cols = [x for x in df.columns if x[0] == "b"]
+
+    # Handle city data differently since each city is only one row
+    if region_type == "city" and region is not None:
+        # For a specific city, just return the single row with NWI level
+        if len(df) == 1:
+            result = df[["nwi"] + cols].copy()
+            return result.reset_index(drop=True)
+
+    # One bincount per column over the NWI level codes; like groupby, only
+    # levels that occur are returned
+    arrays = arrays if arrays is not None else FieldArrays(df, cols)
+    cols = [x for x in cols if x in arrays.columns]
+    _, counts, sums = arrays.level_sums(rows=rows, columns=cols)
+    present = np.flatnonzero(counts[0] > 0)
+    summed = pd.DataFrame({"nwi": pd.array(present).astype(df["nwi"].dtype)})
+    return summed.join(pd.DataFrame({
+        column: sums[0, present, k].astype(np.int64) if pd.api.types.is_integer_dtype(df[column]) else sums[0, present, k]
+        for k, column in enumerate(cols)
+    }))
+
+
+def _column_values(dataset, column, rows):
+    """float64 values of one column at row positions rows (None = all), missing as NaN"""
+    values = dataset[column].array
+    if rows is not None:
+        values = values.take(rows)
+    return values.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def scatter_sample(dataset, rows, demo_column, max_points=5000, seed=42):
+    """Block groups for the demographic scatter plot, sampled before any frame is built.
+
+    rows are positions in dataset (None = every row). Only block groups with
+    population are plotted; above max_points they are sampled per NWI level in
+    proportion to each level's size, so every level keeps its share of the
+    dots. Returns (points, populated): a frame of just the sampled rows and
+    plotted columns, with demo_percentage (demo_column as a % of population)
+    added and missing counts treated as zero; and how many block groups had
+    population before sampling.
+    """
+    positions = np.arange(len(dataset)) if rows is None else np.asarray(rows)
+    population = np.nan_to_num(_column_values(dataset, "b02001_001e", rows))
+    positions = positions[population > 0]
+    populated = len(positions)
+
+    if populated > max_points:
+        rng = np.random.default_rng(seed)
+        levels = dataset["nwi"].to_numpy()[positions]
+        chosen = []
+        for level in np.unique(levels):
+            members = positions[levels == level]
+            quota = max(1, round(max_points * len(members) / populated))
+            chosen.append(rng.choice(members, min(quota, len(members)), replace=False))
+        positions = np.sort(np.concatenate(chosen))
+
+    columns = list(dict.fromkeys(["geoid10", "NWI Level", "nwi_scaled_10", "b02001_001e", demo_column]))
+    # One positional take of just the sampled rows and plotted columns
+    points = dataset.iloc[positions, dataset.columns.get_indexer(columns)]
+    # Missing counts are treated as zero - use nwi_scaled_10 for 1-10 scale
+    points[demo_column] = points[demo_column].fillna(0)
+    points['nwi_scaled_10'] = points['nwi_scaled_10'].fillna(0)
+    points['b02001_001e'] = points['b02001_001e'].fillna(0)
+    # Calculate percentage for the demographic category
+    points['demo_percentage'] = (points[demo_column] / points['b02001_001e'] * 100).fillna(0)
+    return points, populated
+
+
+def scatter_density(dataset, rows, demo_column, percent_bins=20, score_bins=18):
+    """Population-weighted 2D histogram of demographic % x NWI score (1-10) for a heatmap.
+
+    Works on the three needed columns at rows (None = every row) as arrays,
+    without building a frame of the region. Returns one row per non-empty
+    bin: its percentage and score ranges, the Population living in it and
+    the number of Block Groups.
+    """
+    population = np.nan_to_num(_column_values(dataset, "b02001_001e", rows))
+    populated = population > 0
+    population = population[populated]
+    demo = np.nan_to_num(_column_values(dataset, demo_column, rows)[populated])
+    score = np.nan_to_num(_column_values(dataset, "nwi_scaled_10", rows)[populated])
+
+    percentage = np.clip(demo / population * 100, 0, 100)
+    bins = [np.linspace(0, 100, percent_bins + 1), np.linspace(1, 10, score_bins + 1)]
+    score = np.clip(score, 1, 10)
+    weighted, percent_edges, score_edges = np.histogram2d(percentage, score, bins=bins, weights=population)
+    counts, _, _ = np.histogram2d(percentage, score, bins=bins)
+
+    i, j = np.nonzero(counts)
+    return pd.DataFrame({
+        "pct_start": percent_edges[i],
+        "pct_end": percent_edges[i + 1],
+        "score_start": score_edges[j],
+        "score_end": score_edges[j + 1],
+        "Population": weighted[i, j],
+        "Block Groups": counts[i, j].astype(np.int64),
+    })
+
+
+# ------------------------------ Aggregates ---------------------------------
+
+def _field_sum_sql(column):
+    """SQL expression summing one config.fields column per NWI level"""
+    if column in derived_columns:
+        return f"SUM({derived_field_sql(column)})"
+    return f"SUM(CAST({column} AS REAL))"
+
+
+@functools.lru_cache(maxsize=None)
+def load_cube():
+    """Load the precomputed region cube indexed by (region_type, region), or None"""
+    if not artifact_available(CUBE_PATH):
+        return None
+    cube = pd.read_parquet(CUBE_PATH)
+    return cube.set_index(["region_type", "region"]).sort_index()
+
+
+def region_aggregate(region_type, region_name):
+    """Per-NWI-level sums of the config.fields columns for one region.
+
+    Also returns nwi_weighted, the sum of nwi_scaled_10 x population, so the
+    weighted mean NWI is nwi_weighted.sum() / b02001_001e.sum(). Rows come
+    from the region cube when it has been built; otherwise the GROUP BY runs
+    inside SQLite. Either way only four rows come back regardless of how many
+    block groups the region has. Levels follow the classify_nwi rule for the
+    whole table (see nwi_level_sql), as in the cube and the loaded dataset.
+    """
+    cube = load_cube()
+    key = (region_type, "United States" if region_type == "National" else region_name)
+    if cube is not None and key in cube.index:
+        # The index is sorted, so get_loc gives a row slice (much faster than .loc[[key]])
+        return cube.iloc[cube.index.get_loc(key)].reset_index(drop=True)
+
+    where, params = region_filter_sql(region_type, region_name)
+    if where is None:
+        return pd.DataFrame()
+    sums = ",\n".join(f"{_field_sum_sql(column)} AS {column}" for column in field_columns)
+    with connect_readonly() as conn:
+        return pd.read_sql(f"""
+            SELECT {nwi_level_sql()} AS nwi,
+            {sums},
+            SUM(CAST(nwi_scaled_10 AS REAL) * CAST(b02001_001e AS REAL)) AS nwi_weighted
+            FROM nwi_full
+            WHERE {where}
+            GROUP BY 1
+            ORDER BY 1
+        """, conn, params=params)
+
+
+def population_by_level(summed):
+    """Population per NWI level from a region aggregate, with its "NWI Level" name"""
+    population = summed[["nwi", "b02001_001e"]].rename(columns={"b02001_001e": "Population"})
+    population["NWI Level"] = pd.Categorical(population["nwi"].map(nwi_level_names))
+    return population
+
+
+def weighted_average_nwi(summed):
+    """Population-weighted mean nwi_scaled_10 (1-10 scale) from a region aggregate, 0 if no population"""
+    if summed.empty:
+        return 0
+    total_population = summed["b02001_001e"].sum()
+    # Protect against division by zero if there's no population data
+    if total_population > 0:
+        return summed["nwi_weighted"].sum() / total_population
+    return 0
+
+
+def demographic_breakdown(summed, demographic):
+    """Tidy (NWI Level x Category) table for one config.field_dict demographic.
+
+    summed holds per-NWI-level sums (an "nwi" column plus the field columns),
+    as returned by region_aggregate. Every level/category pair is present,
+    with its Population, "Level Percentage" (share of that level's total for
+    the demographic) and "Category Percentage" (share of that category's total
+    across levels).
+    """
+    demo_dict = field_dict[demographic]
+    columns = [column.lower() for column in demo_dict.values()]
+    # One row per NWI level (0-3), one column per category
+    by_level = (
+        summed.groupby("nwi")[columns].sum()
+        .reindex(range(4), fill_value=0)
+        .set_axis(list(demo_dict.keys()), axis=1)
+    )
+    level_totals = by_level.sum(axis=1)
+    category_totals = by_level.sum(axis=0)
+
+    tidy = by_level.stack().rename("Population").reset_index()
+    tidy.columns = ["NWI Level", "Category", "Population"]
+    tidy["NWI Level"] += 1
+    level_total = tidy["NWI Level"].map(level_totals.set_axis(range(1, 5)))
+    category_total = tidy["Category"].map(category_totals)
+    tidy["Level Percentage"] = (tidy["Population"] / level_total * 100).where(level_total > 0, 0)
+    tidy["Category Percentage"] = (tidy["Population"] / category_total * 100).where(category_total > 0, 0)
+    return tidy
+
+
+def regions_aggregate(regions):
+    """region_aggregate() for several (region_type, region) pairs at once.
+
+    Returns one frame with region_type, region, nwi, the field sums and
+    nwi_weighted for every region that has block groups. Regions in the cube
+    are read with one positional take; any others are summed by a single
+    SQLite statement (one GROUP BY per region joined with UNION ALL).
+    """
+    keys = list(dict.fromkeys(
+        (region_type, "United States" if region_type == "National" else region) for region_type, region in regions
+    ))
+    parts = []
+    cube = load_cube()
+    if cube is not None:
+        found = [key for key in keys if key in cube.index]
+        if found:
+            positions = np.concatenate([
+                np.arange(len(cube))[cube.index.get_loc(key)] for key in found
+            ])
+            parts.append(cube.iloc[positions].reset_index())
+        keys = [key for key in keys if key not in found]
+
+    queries, params = [], []
+    for region_type, region in keys:
+        where, where_params = region_filter_sql(region_type, region)
+        if where is None:
+            continue
+        queries.append(f"""
+            SELECT ? AS region_type, ? AS region, {nwi_level_sql()} AS nwi,
+            {", ".join(f"{_field_sum_sql(column)} AS {column}" for column in field_columns)},
+            SUM(CAST(nwi_scaled_10 AS REAL) * CAST(b02001_001e AS REAL)) AS nwi_weighted
+            FROM nwi_full
+            WHERE {where}
+            GROUP BY 3
+        """)
+        params += [region_type, region] + where_params
+    if queries:
+        with connect_readonly() as conn:
+            parts.append(pd.read_sql(" UNION ALL ".join(queries), conn, params=params))
+    # Regions without block groups give empty (untyped) results
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=["region_type", "region", "nwi"] + field_columns + ["nwi_weighted"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def compare_regions(regions, demographics=()):
+    """Per-level populations, weighted NWI and demographic breakdowns for several regions.
+
+    regions is a list of (region_type, region) pairs; all of them are summed
+    by one regions_aggregate() call. Returns (summary, breakdowns):
+
+    summary has one row per region with block groups, in the order given:
+    "Region Type", "Region", the population at each nwi_level_names level,
+    "Population" and "Weighted NWI".
+
+    breakdowns is the region_breakdowns() table for the demographics, with
+    "Region Type" and "Region" in front.
+    """
+    summed = regions_aggregate(regions)
+    order = list(dict.fromkeys(
+        (region_type, "United States" if region_type == "National" else region) for region_type, region in regions
+    ))
+    keys = pd.MultiIndex.from_tuples(order, names=["region_type", "region"])
+
+    levels = (
+        summed.pivot_table(index=["region_type", "region"], columns="nwi", values="b02001_001e", aggfunc="sum")
+        .reindex(columns=range(4), fill_value=0).fillna(0)
+    )
+    totals = summed.groupby(["region_type", "region"])[["b02001_001e", "nwi_weighted"]].sum()
+    summary = levels.set_axis([nwi_level_names[level] for level in range(4)], axis=1)
+    summary["Population"] = totals["b02001_001e"]
+    # 0 where a region has no population, as in weighted_average_nwi
+    summary["Weighted NWI"] = (totals["nwi_weighted"] / totals["b02001_001e"]).where(totals["b02001_001e"] > 0, 0)
+    summary = summary.reindex(keys[keys.isin(summary.index)])
+    summary = summary.rename_axis(["Region Type", "Region"]).reset_index()
+
+    if not demographics or summed.empty:
+        return summary, pd.DataFrame()
+    # Breakdowns by one grouped pass over the aggregated rows, keyed per region
+    summed["region_key"] = summed["region_type"] + "\t" + summed["region"]
+    breakdowns = region_breakdowns(summed, "region_key", demographics)
+    breakdowns[["Region Type", "Region"]] = breakdowns.pop("region_key").str.split("\t", n=1, expand=True)
+    columns = ["Region Type", "Region"] + [column for column in breakdowns.columns if column not in ("Region Type", "Region")]
+    return summary, breakdowns[columns]
+
+
+def region_key(df, region_type):
+    """Each block group's region name as shown in the dropdowns ("City, State" for cities)"""
+    if region_type == "National":
+        return pd.Series("United States", index=df.index)
+    elif region_type == "State":
+        return df["state_name"]
+    elif region_type == "County":
+        return df["county_name"]
+    elif region_type == "CSA":
+        return df["csa_name"]
+    elif region_type == "City":
+        return df["city_name"] + ", " + df["state_name"]
+    raise ValueError(f"Unknown region type: {region_type}")
+
+
+def build_region_dimension(df):
+    """Region dimension (see region_dimension()) from a frame of every block group"""
+    parts = []
+    for region_type in region_list_keys:
+        pairs = pd.DataFrame({
+            "region": region_key(df, region_type),
+            "state": df["state_name"],
+            "population": df["b02001_001e"],
+        }).groupby(["region", "state"], dropna=False, observed=True).agg(
+            block_groups=("population", "size"), population=("population", "sum"),
+        ).reset_index()
+        pairs = pairs[pairs["region"].notna()]
+        pairs.insert(0, "region_type", region_type)
+        parts.append(pairs)
+    return collapse_region_states(pd.concat(parts, ignore_index=True))
+
+
+def region_breakdowns(df, region_column, demographics):
+    """demographic_breakdown() for every region in df and several demographics at once.
+
+    One grouped sum over df gives every region's per-NWI-level totals; the
+    tidy result has region_column and "Demographic" in front of the
+    demographic_breakdown columns. Unclassified frames get their levels from
+    nwi_levels().
+    """
+    columns = list(dict.fromkeys(
+        column.lower() for demographic in demographics for column in field_dict[demographic].values()
+    ))
+    nwi = nwi_levels(df).astype(int)
+    summed = df[columns].groupby([df[region_column], nwi]).sum()
+    # Every region gets all four levels, like the reindex in demographic_breakdown
+    regions = summed.index.get_level_values(0).unique()
+    summed = summed.reindex(
+        pd.MultiIndex.from_product([regions, range(4)], names=[region_column, "nwi"]), fill_value=0
+    )
+
+    frames = []
+    for demographic in demographics:
+        demo_dict = field_dict[demographic]
+        by_level = summed[[column.lower() for column in demo_dict.values()]].set_axis(list(demo_dict.keys()), axis=1)
+        tidy = by_level.stack().rename("Population").astype("float64").reset_index()
+        tidy.columns = [region_column, "NWI Level", "Category", "Population"]
+        level_total = tidy.groupby([region_column, "NWI Level"])["Population"].transform("sum")
+        category_total = tidy.groupby([region_column, "Category"])["Population"].transform("sum")
+        tidy["NWI Level"] += 1
+        tidy["Level Percentage"] = (tidy["Population"] / level_total * 100).where(level_total > 0, 0)
+        tidy["Category Percentage"] = (tidy["Population"] / category_total * 100).where(category_total > 0, 0)
+        tidy.insert(1, "Demographic", demographic)
+        frames.append(tidy)
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarize_regions(df, region_column, nwi_column="nwi_scaled_10", population_column="b02001_001e",
+                      arrays=None, rows=None):
+    """Population by NWI level, weighted average NWI and rank for every region.
+
+    All regions are computed with bincount sums over integer region codes
+    (see FieldArrays) in a single pass over df instead of filtering df once
+    per region. arrays is a FieldArrays over df holding population_column to
+    reuse (its region codes are kept between calls), rows positions in df
+    (None = all). Returns one row per region (sorted by name) with the region
+    column, one population column per nwi_to_label_map label, "Avg
+    Walkability Index" and "Rank".
+    """
+    arrays = arrays if arrays is not None else FieldArrays(df, [population_column])
+    regions, counts, sums = arrays.level_sums(region_column, rows, [population_column])
+
+    # Population by NWI level, missing where a region has no block groups at a
+    # level; like a pivot, only levels and regions that occur are kept
+    levels = np.flatnonzero(counts.sum(axis=0) > 0)
+    present = np.flatnonzero(counts.sum(axis=1) > 0)
+    by_level = np.where(counts > 0, sums[:, :, 0], np.nan)[np.ix_(present, levels)]
+    final_df = pd.DataFrame(by_level, columns=[nwi_to_label_map[level] for level in levels])
+    if not np.isnan(by_level).any() and pd.api.types.is_integer_dtype(df[population_column]):
+        final_df = final_df.astype(np.int64)
+
+    # Weighted average NWI for each region (0 where the region has no population)
+    population = np.nan_to_num(_column_values(df, population_column, rows))
+    weighted = np.nan_to_num(_column_values(df, nwi_column, rows) * population)
+    total_sums = arrays.region_totals(region_column, population, rows)[present]
+    weighted_sums = arrays.region_totals(region_column, weighted, rows)[present]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        final_df["Avg Walkability Index"] = np.where(total_sums > 0, weighted_sums / total_sums, 0)
+
+    final_df["Rank"] = final_df["Avg Walkability Index"].rank(method='min', ascending=False).astype(int)
+    final_df.insert(0, region_column, pd.Index(regions)[present])
+    return final_df
+
+
+def ranked_regions(df, region_column, arrays=None, rows=None):
+    """summarize_regions() output with Rank first, the region column renamed "Name", rank 1 on top"""
+    final_df = summarize_regions(df, region_column, arrays=arrays, rows=rows)
+
+    final_df.insert(0, "Rank", final_df.pop("Rank"))
+
+    final_df = final_df.rename(columns=lambda x: 'Name' if '_name' in x else x)
+
+    # Sort by rank with 1 at the top
+    return final_df.sort_values('Rank').reset_index(drop=True)
+
+
+def calculate_weighted_average_nwi_b(
+    df, nwi_column="nwi", population_column="b02001_001e"
+):
+    if df.empty:
+        return 0
+
+    df[nwi_column] = pd.to_numeric(df[nwi_column], errors="coerce")
+    df[population_column] = pd.to_numeric(df[population_column], errors="coerce")
+
+    weighted_nwi_sum = (df[nwi_column] * df[population_column]).sum()
+    total_population = df[population_column].sum()
+
+    if total_population > 0:
+        return weighted_nwi_sum / total_population
+    else:
+        return 0
+
+
+def calculate_weighted_average_nwi_c(df, nwi_column, population_column):
+    if df.empty:
+        return 0
+
+    # Always use nwi_scaled_10 for 1-10 scale
+    nwi_column = "nwi_scaled_10"
+    nwi_values = df[nwi_column]
+    populations = df[population_column]
+
+    weighted_nwi_sum = (nwi_values * populations).sum()
+    total_population = populations.sum()
+
+    return weighted_nwi_sum / total_population if total_population > 0 else 0
+
+
+# ----------------------------- Summary tables ------------------------------
+
+# Population columns of the summary tables, one per NWI level
+summary_population_columns = ["1 - Least Walkable", "2 - Below Avg", "3 - Above Avg", "4 - Most Walkable"]
+
+
+def summary_path(region_type):
+    """Path of the summary table for a region type (State, County, CSA or City)"""
+    return f"data/summary_{summary_names[region_type]}.parquet"
+
+
+def summary_table(region_type, state=None):
+    """Ranked summary table for a region type, optionally only the regions in one state.
+
+    Rank 1 comes first. Results are memoized per process and file version
+    (a regenerated table is read again), so treat them as read-only. The
+    Parquet tables keep each state in its own row group, so a state filter
+    is pushed down to the reader and only that state's rows are decoded.
+    Raises FileNotFoundError if the table is missing or out of date (run
+    generate_summary_tables.py).
+    """
+    path = summary_path(region_type)
+    if not artifact_available(path):
+        raise FileNotFoundError(f"{path} is missing or out of date. Run generate_summary_tables.py.")
+    return _read_summary_table(region_type, state, path, os.stat(path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=256)
+def _read_summary_table(region_type, state, path, mtime_ns):
+    """summary_table() for one version (path and mtime) of the table"""
+    filters = [("State", "==", state)] if state is not None else None
+    df = pd.read_parquet(path, filters=filters)
+    return df.sort_values("Rank", kind="stable").reset_index(drop=True)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the data loading and aggregation hot paths on synthetic data.
+
+A synthetic nwi_full table (same column names and TEXT storage as the real
+database, with every config.fields column) is generated in a scratch
+directory at the requested scale, and each step the app and the batch
+scripts run is timed against it, first reading SQLite directly and then
+through the Parquet snapshot, region cube and region dimension:
+
+    python benchmark.py --block-groups 100000 -o bench_new.json
+    python benchmark.py --compare bench_old.json bench_new.json
+
+Results are written as JSON (median/min seconds over --repeats runs) so two
+commits can be compared with --compare.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import build_manifest
+from config import field_dict, fields
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_database(db_path, block_groups, seed=0):
+    """Write an nwi_full table of synthetic block groups to db_path.
+
+    Region sizes roughly follow the real data (about 700 block groups per
+    county and 60 per city, a CSA for most counties), every state in
+    analytics.state_fips_to_name is used, and the numeric columns are stored
+    as TEXT with a few blanks and unparseable values like the source table.
+    """
+    rng = np.random.default_rng(seed)
+    fips = np.array(list(analytics.state_fips_to_name))
+    state_codes = rng.integers(0, len(fips), block_groups)
+    state_names = np.array(list(analytics.state_fips_to_name.values()), dtype=object)[state_codes]
+
+    counties = max(1, block_groups // 700)
+    county = rng.integers(0, counties, block_groups)
+    cities = max(1, block_groups // 60)
+    city = rng.integers(0, cities, block_groups)
+
+    df = pd.DataFrame({
+        "geoid10": pd.Series(fips[state_codes], dtype=object) + pd.Series(np.arange(block_groups)).map("{:010d}".format),
+        "geography_type": "block_group",
+        "state_name": state_names,
+        "county_name": pd.Series(county).map("County {}".format),
+        "csa_name": pd.Series(county % max(1, counties // 3)).map("CSA {}".format).where(county % 4 != 0),
+        "city_name": pd.Series(city).map("City {}".format).where(rng.random(block_groups) < 0.7),
+    })
+    # A few block groups are missing their state name, as in the source table
+    df.loc[rng.random(block_groups) < 0.01, "state_name"] = None
+
+    df["natwalkind"] = rng.uniform(1, 20, block_groups).round(4)
+    df["nwi"] = np.digitize(df["natwalkind"], [5.75, 10.5, 15.25]).astype(float)
+    df.loc[rng.random(block_groups) < 0.01, "nwi"] = np.nan
+    df["nwi_scaled_10"] = (df["natwalkind"] / 2).round(3)
+
+    for field in fields:
+        values = rng.integers(0, 2000, block_groups).astype(str).astype(object)
+        values[rng.random(block_groups) < 0.002] = None
+        values[rng.random(block_groups) < 0.001] = "N/A"
+        df[field.lower()] = values
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DROP TABLE IF EXISTS nwi_full")
+        df.to_sql("nwi_full", conn, index=False, chunksize=50000,
+                  dtype={"nwi": "REAL", "nwi_scaled_10": "REAL", "natwalkind": "REAL"})
+
+
+def sample_regions():
+    """One region of each type with a typical number of block groups"""
+    regions = analytics.region_lists()
+    return {
+        "National": None,
+        "State": regions["states"][len(regions["states"]) // 2],
+        "County": regions["counties"][len(regions["counties"]) // 2],
+        "CSA": regions["csas"][len(regions["csas"]) // 2],
+        "City": regions["cities"][len(regions["cities"]) // 2],
+    }
+
+
+def time_call(func, repeats):
+    """(median seconds, min seconds, last result) over repeats calls"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), min(times), result
+
+
+def run_suite(backend, repeats):
+    """Time every benchmark against the current data/ directory; returns result dicts"""
+    # Artifact availability, the region dimension and the cube are memoized per process
+    analytics.stale_artifacts.cache_clear()
+    analytics.snapshot_nwi_method.cache_clear()
+    analytics.table_nwi_quartiles.cache_clear()
+    analytics.region_dimension.cache_clear()
+    analytics.load_cube.cache_clear()
+
+    results = []
+
+    def bench(name, func):
+        median, fastest, result = time_call(func, repeats)
+        rows = len(result[0] if isinstance(result, tuple) else result) if result is not None else None
+        results.append({
+            "name": name, "backend": backend, "median_s": median, "min_s": fastest,
+            "repeats": repeats, "rows": rows,
+        })
+        print(f"  {backend:<8} {name:<38} {median * 1000:10.2f} ms  (min {fastest * 1000:.2f} ms)")
+        return result
+
+    def load_region_lists():
+        # Time reading the region dimension, not its per-process memo
+        analytics.region_dimension.cache_clear()
+        return analytics.region_lists()
+
+    regions = sample_regions()
+    bench("load_region_lists", load_region_lists)
+    frames = {}
+    for region_type, region in regions.items():
+        frames[region_type] = bench(
+            f"load_region_data[{region_type}]", lambda: analytics.load_region_frame(region_type, region)
+        )
+    for region_type, region in regions.items():
+        bench(f"load_region_aggregate[{region_type}]", lambda: analytics.region_aggregate(region_type, region))
+
+    national = analytics.classify_nwi(frames["National"])
+    state = analytics.classify_nwi(frames["State"])
+    bench("group_by_region[State]", lambda: analytics.group_by_region(state, "state", regions["State"]))
+    arrays = bench("FieldArrays[National]", lambda: [analytics.FieldArrays(national)])[0]
+    state_rows = analytics.region_positions(national, "State", regions["State"])
+    bench("group_by_region[State, arrays]", lambda: analytics.group_by_region(
+        national, "state", regions["State"], arrays=arrays, rows=state_rows
+    ))
+    bench("ranked_regions[county_name, arrays]", lambda: analytics.ranked_regions(national, "county_name", arrays=arrays))
+
+    summed = analytics.region_aggregate("State", regions["State"])
+    bench("demo_viz_b/d prep[State, all]", lambda: [
+        analytics.demographic_breakdown(summed, demographic) for demographic in field_dict
+    ])
+    bench("compare_regions[all types, all]", lambda: analytics.compare_regions(list(regions.items()), list(field_dict)))
+    scatter_column = field_dict["Race"]["White"].lower()
+    bench("demo_scatter_plot prep[National]", lambda: analytics.scatter_sample(national, None, scatter_column))
+    bench("demo_scatter_plot heatmap[National]", lambda: analytics.scatter_density(national, None, scatter_column))
+    bench("summarize_regions[county_name]", lambda: analytics.summarize_regions(national, "county_name"))
+
+    from generate_summary_tables import create_summary_table, table_inputs
+
+    national["fips_state_name"] = analytics.state_names_from_fips(national["geoid10"])
+    bench("create_summary_table[counties]", lambda: create_summary_table(
+        national, "county_name", "summary_counties.parquet"
+    ))
+    # Recorded like generate_summary_tables.py does, so summary_table() serves it
+    build_manifest.record_artifacts(["summary_counties.parquet"], table_inputs(), analytics.DB_PATH)
+    analytics.stale_artifacts.cache_clear()
+
+    def summary_table():
+        # Time reading the table, not its per-process memo
+        analytics._read_summary_table.cache_clear()
+        return analytics.summary_table("County", regions["State"])
+
+    bench("summary_table[County, state]", summary_table)
+    return results
+
+
+def build_artifacts():
+    """Build the Parquet snapshot, region cube and region dimension with the build scripts' own code"""
+    import build_dataset
+    from generate_summary_tables import create_region_cube, create_region_dimension, load_table_frame, table_inputs
+
+    build_dataset.build_snapshot(build_manifest.current_inputs(analytics.DB_PATH))
+
+    analytics.stale_artifacts.cache_clear()
+    analytics.snapshot_nwi_method.cache_clear()
+    df = load_table_frame()
+    create_region_cube(df)
+    create_region_dimension(df)
+    build_manifest.record_artifacts(
+        [os.path.basename(analytics.CUBE_PATH), os.path.basename(analytics.REGIONS_PATH)], table_inputs(), analytics.DB_PATH
+    )
+
+
+def git_commit():
+    """Current commit of the repository, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    """Print new vs old median time for every benchmark in both files"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_results = {(r["backend"], r["name"]): r for r in old["results"]}
+    print(f"{old_path} ({old.get('commit')}, {old['block_groups']:,} block groups) -> "
+          f"{new_path} ({new.get('commit')}, {new['block_groups']:,} block groups)")
+    for result in new["results"]:
+        before = old_results.get((result["backend"], result["name"]))
+        if before is None:
+            continue
+        ratio = result["median_s"] / before["median_s"] if before["median_s"] else float("inf")
+        flag = "  slower" if ratio > 1.1 else "  faster" if ratio < 0.9 else ""
+        print(f"  {result['backend']:<8} {result['name']:<38} {before['median_s'] * 1000:10.2f} ms -> "
+              f"{result['median_s'] * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--block-groups", type=int, default=100000, help="synthetic table size (10k to 1M is typical)")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Progress goes to stderr so the JSON can be piped from stdout
+    with tempfile.TemporaryDirectory(prefix="nwi_benchmark_") as workdir, contextlib.redirect_stdout(sys.stderr):
+        # The analytics paths are relative to the working directory
+        os.chdir(workdir)
+        os.makedirs("data")
+        print(f"Generating {args.block_groups:,} synthetic block groups...")
+        start = time.perf_counter()
+        generate_database(analytics.DB_PATH, args.block_groups, args.seed)
+        print(f"Generated in {time.perf_counter() - start:.1f}s")
+
+        results = run_suite("sqlite", args.repeats)
+        print("Building the snapshot, region cube and region dimension...")
+        build_artifacts()
+        results += run_suite("parquet", args.repeats)
+        os.chdir(REPO_DIR)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "block_groups": args.block_groups,
+        "seed": args.seed,
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {len(results)} results to {output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Script to export the block group rows of nwi_full to a columnar snapshot.
+load_data() and load_region_data() read this Parquet file when it exists
+instead of pulling every row through sqlite3 and pd.read_sql.
+
+The ACS and NWI columns are stored as TEXT in SQLite, so they are cast to
+int/float here once rather than on every chart render. The columns defined in
+config.derived_fields (e.g. Hispanic population) are computed here too and
+stored alongside them, and every block group gets its NWI level (0-3, int8)
+by the classify_nwi rule; the method used is recorded in the build manifest.
+
+The snapshot is only rebuilt when the source table changed since the last
+build (see build_manifest.py); pass --force to rebuild it anyway.
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+import build_manifest
+from analytics import (
+    DB_PATH,
+    SNAPSHOT_PATH,
+    add_derived_fields,
+    classify_nwi,
+    derived_columns,
+    normalize_types,
+    nwi_classification_method,
+)
+
+
+def read_block_groups(db_path=DB_PATH):
+    """Read every block group row from the SQLite table"""
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        return pd.read_sql("""
+            SELECT * FROM nwi_full
+            WHERE geography_type = 'block_group'
+        """, conn)
+
+
+def write_snapshot(df, snapshot_path=SNAPSHOT_PATH):
+    """Write the block group frame to Parquet, replacing any previous snapshot"""
+    os.makedirs(os.path.dirname(snapshot_path) or ".", exist_ok=True)
+    tmp_path = f"{snapshot_path}.tmp"
+    df.to_parquet(tmp_path, engine="pyarrow", index=False, compression="zstd")
+    os.replace(tmp_path, snapshot_path)
+
+
+def build_snapshot(inputs, db_path=DB_PATH):
+    """Read, type, derive and classify the block groups, write the snapshot and record it.
+
+    inputs are the build_manifest.current_inputs() the snapshot is recorded
+    with; returns the classify_nwi method used.
+    """
+    name = os.path.basename(SNAPSHOT_PATH)
+    print(f"Reading block groups from {db_path}...")
+    start = time.perf_counter()
+    df = read_block_groups(db_path)
+    print(f"Read {len(df):,} rows x {len(df.columns)} columns in {time.perf_counter() - start:.1f}s")
+
+    failures = normalize_types(df)
+    if failures:
+        print("Values that failed to parse as numbers (stored as missing):")
+        for column, count in failures.items():
+            print(f"  - {column}: {count:,}")
+    else:
+        print("All numeric columns parsed cleanly")
+    add_derived_fields(df)
+    print(f"Computed derived columns: {', '.join(derived_columns)}")
+    method = nwi_classification_method(df)
+    missing = int(df["nwi"].isna().sum())
+    classify_nwi(df)
+    del df["NWI Level"]  # added from nwi when loading
+    print(f"Classified NWI levels by {method} ({missing:,} block groups had no nwi)")
+
+    start = time.perf_counter()
+    write_snapshot(df)
+    size_mb = os.path.getsize(SNAPSHOT_PATH) / 1e6
+    print(f"Saved {SNAPSHOT_PATH} ({size_mb:.1f} MB) in {time.perf_counter() - start:.1f}s")
+    build_manifest.record_artifacts([name], inputs, db_path, details={"nwi_classification": method})
+    return method
+
+
+def main():
+    """Build the columnar snapshot of the block group table"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--force", action="store_true", help="rebuild even if the inputs are unchanged")
+    args = parser.parse_args()
+
+    name = os.path.basename(SNAPSHOT_PATH)
+    inputs = build_manifest.current_inputs(DB_PATH)
+    # Snapshots from before the NWI levels were classified at build time are rebuilt too
+    classified = build_manifest.artifact_details(name, "nwi_classification") is not None
+    if not args.force and classified and not build_manifest.stale_artifacts([name], inputs):
+        print(f"{SNAPSHOT_PATH} is up to date (use --force to rebuild)")
+        return
+
+    build_snapshot(inputs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Build manifest for the generated data artifacts (snapshot, cube, summary tables).
+
+Each artifact is recorded with a fingerprint of the inputs it was built from:
+the contents of the nwi_full table and the config.field_dict and
+config.derived_fields definitions. Artifacts built from the classified
+block groups (cube, region dimension, summary tables) also record the
+classify_nwi method applied (nwi_classification). The build scripts only rebuild artifacts whose inputs changed, and the app uses the
+same check to refuse serving artifacts that are out of date.
+
+Hashing the table means reading every row, so the source fingerprint is cached
+in the manifest together with the database file's size and mtime and is only
+recomputed when those change. Within a process it is also computed at most
+once per file state, so a build script and the app-side staleness check it
+triggers share one hash.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from config import derived_fields, field_dict
+
+MANIFEST_PATH = 'data/build_manifest.json'
+
+# Fingerprints hashed by this process, by (path, size, mtime_ns)
+_fingerprints = {}
+
+
+def read_manifest(manifest_path=MANIFEST_PATH):
+    """Load the manifest, or an empty one if it has not been written yet"""
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"source": {}, "artifacts": {}}
+
+
+def write_manifest(manifest, manifest_path=MANIFEST_PATH):
+    """Write the manifest atomically so a crashed build never leaves it half-written"""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def table_fingerprint(db_path, table="nwi_full"):
+    """sha256 over the table's schema and every row, independent of indexes or VACUUM"""
+    digest = hashlib.sha256()
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        schema = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", [table]
+        ).fetchone()
+        digest.update(repr(schema).encode())
+        cursor = conn.execute(f"SELECT * FROM {table} ORDER BY rowid")
+        while rows := cursor.fetchmany(10000):
+            digest.update(repr(rows).encode())
+    return digest.hexdigest()
+
+
+def source_fingerprint(db_path, manifest=None):
+    """Fingerprint of the source table, reusing the cached value if the file is unchanged"""
+    manifest = manifest if manifest is not None else read_manifest()
+    stat = os.stat(db_path)
+    cached = manifest.get("source", {})
+    if cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+        return cached["fingerprint"]
+    key = (os.path.abspath(db_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprints:
+        _fingerprints[key] = table_fingerprint(db_path)
+    return _fingerprints[key]
+
+
+def refresh_source_fingerprint(db_path, manifest_path=MANIFEST_PATH):
+    """Recompute and cache the source fingerprint (call after writing to the database)"""
+    manifest = read_manifest(manifest_path)
+    stat = os.stat(db_path)
+    manifest["source"] = {
+        "path": db_path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "fingerprint": table_fingerprint(db_path),
+    }
+    write_manifest(manifest, manifest_path)
+    return manifest["source"]["fingerprint"]
+
+
+def field_dict_fingerprint():
+    """sha256 of the config.field_dict definition"""
+    return hashlib.sha256(json.dumps(field_dict, sort_keys=True).encode()).hexdigest()
+
+
+def derived_fields_fingerprint():
+    """sha256 of the config.derived_fields definitions"""
+    return hashlib.sha256(json.dumps(derived_fields, sort_keys=True).encode()).hexdigest()
+
+
+def current_inputs(db_path, manifest=None):
+    """Fingerprints of everything an artifact is built from"""
+    return {
+        "source": source_fingerprint(db_path, manifest),
+        "field_dict": field_dict_fingerprint(),
+        "derived_fields": derived_fields_fingerprint(),
+    }
+
+
+def stale_artifacts(names, inputs, manifest=None, data_dir="data"):
+    """Map each out-of-date artifact in names to the reason it needs rebuilding"""
+    manifest = manifest if manifest is not None else read_manifest()
+    stale = {}
+    for name in names:
+        record = manifest.get("artifacts", {}).get(name)
+        if not os.path.exists(os.path.join(data_dir, name)):
+            stale[name] = "missing"
+        elif record is None:
+            stale[name] = "not recorded in the build manifest"
+        else:
+            changed = [key for key, value in inputs.items() if record.get(key) != value]
+            if changed:
+                stale[name] = f"{' and '.join(changed)} changed since it was built"
+    return stale
+
+
+def record_artifacts(names, inputs, db_path, manifest_path=MANIFEST_PATH, details=None):
+    """Record that names were just built from inputs (plus any details about how, e.g. methods used)"""
+    manifest = read_manifest(manifest_path)
+    stat = os.stat(db_path)
+    manifest["source"] = {
+        "path": db_path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "fingerprint": inputs["source"],
+    }
+    built_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    for name in names:
+        manifest.setdefault("artifacts", {})[name] = dict(inputs, built_at=built_at, **(details or {}))
+    write_manifest(manifest, manifest_path)
+
+
+def artifact_details(name, key, manifest=None):
+    """A detail recorded with an artifact by record_artifacts(), or None"""
+    manifest = manifest if manifest is not None else read_manifest()
+    return manifest.get("artifacts", {}).get(name, {}).get(key)
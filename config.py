@@ -21,7 +21,7 @@ field_dict = {
         "Two or More": "B02001_008E",
     },
     "Ethnicity": {
-        # B03002_012E is computed in data_handler.py as: total pop - non-Hispanic
+        # B03002_012E is derived (see derived_fields below): total pop - non-Hispanic
         # (B02001_001E - B03002_002E), excluding block groups with missing B03002 data
         "Hispanic": "B03002_012E",
         "Non-Hispanic": "B03002_002E",
@@ -85,6 +85,19 @@ field_dict = {
 
 fields = [value for sub_dict in field_dict.values() for value in sub_dict.values()]
 
+# Columns computed from other ACS columns rather than read from the database.
+# Each value is "expression" where "condition" holds and 0 elsewhere, with
+# missing inputs counted as 0. Both are plain arithmetic and comparisons over
+# column names, which pandas (DataFrame.eval) and SQLite evaluate alike.
+# build_dataset.py stores the results in the snapshot like any other column;
+# the SQLite fallback reads use the same definitions as SQL expressions.
+derived_fields = {
+    "B03002_012E": {
+        "expression": "B02001_001E - B03002_002E",
+        "condition": "B03002_002E > 0",
+    },
+}
+
 demo_cats = {
     "Age": "",
     "Race": "",
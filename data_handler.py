@@ -1,11 +1,19 @@
 import pandas as pd
+import numpy as np
 from config import field_dict, colors, fields, nwi_labels
 import altair as alt
 import streamlit as st
-import sqlite3
+import analytics
+from analytics import default_columns, demographic_breakdown
+from diagnostics import instrumented
 # import pygris
 
-# Remove global connection - use context managers instead
+# The computations live in analytics.py (no Streamlit); this module adds the
+# Streamlit caching, error messages, session state and Altair charts on top.
+
+# Candidates the region search box offers per query (County and City have too
+# many names to send the whole list to the browser)
+REGION_MATCHES = 20
 
 
 def set_region_type():
@@ -92,184 +100,155 @@ def group_by_geography(df, fields=fields, region_type="national"):
 # @st.cache_data(persist=True)
 @st.cache_data
 def group_by_region(df, region_type, region):
-    cols = [x for x in df.columns if x[0] == "b"]
-    
-    # Handle city data differently since each city is only one row
-    if region_type == "city" and region is not None:
-        # For a specific city, just return the single row with NWI level
-        if len(df) == 1:
-            result = df[["nwi"] + cols].copy()
-            return result.reset_index(drop=True)
-    
-    # Normal groupby for block group data or multiple cities
-    summed = df.groupby("nwi")[cols].sum().reset_index()
-    return summed
+    return analytics.group_by_region(df, region_type, region)
 
 
-@st.cache_data
+@st.cache_resource
+def stale_build_artifacts():
+    """Check the build manifest once per process; returns {artifact: reason} for stale ones"""
+    return analytics.stale_artifacts()
+
+
+@instrumented("load_region_lists", cache=st.cache_data)
 def load_region_lists():
     """Load only region names for dropdowns - much faster than full dataset"""
     try:
-        with sqlite3.connect('data/nwi_full_2019_complete.db', timeout=30) as conn:
-            regions = {}
-
-            # Get state names
-            regions['states'] = pd.read_sql("""
-                SELECT DISTINCT state_name
-                FROM nwi_full
-                WHERE state_name IS NOT NULL
-                ORDER BY state_name
-            """, conn)['state_name'].tolist()
-
-            # Get county names
-            regions['counties'] = pd.read_sql("""
-                SELECT DISTINCT county_name
-                FROM nwi_full
-                WHERE county_name IS NOT NULL
-                ORDER BY county_name
-            """, conn)['county_name'].tolist()
-
-            # Get CSA names
-            regions['csas'] = pd.read_sql("""
-                SELECT DISTINCT csa_name
-                FROM nwi_full
-                WHERE csa_name IS NOT NULL
-                ORDER BY csa_name
-            """, conn)['csa_name'].tolist()
-
-            # Get city names with state (like the existing get_city_names function)
-            regions['cities'] = pd.read_sql("""
-                SELECT DISTINCT city_name || ', ' || state_name as city_display
-                FROM nwi_full
-                WHERE city_name IS NOT NULL AND state_name IS NOT NULL
-                ORDER BY city_display
-            """, conn)['city_display'].tolist()
-
-            return regions
+        return analytics.region_lists()
     except Exception as e:
         st.error(f"Error loading region lists: {str(e)}")
         return {'states': [], 'counties': [], 'csas': [], 'cities': []}
 
-@st.cache_data
-def load_region_data(region_type, region_name):
-    """Load data for a specific region only"""
+
+@instrumented("load_region_data", cache=st.cache_data)
+def load_region_data(region_type, region_name, columns=default_columns, compact=True):
+    """Load data for a specific region only (cached per argument set, see analytics.load_region_frame)"""
+    return _load_region_frame(region_type, region_name, columns, compact)
+
+
+def _load_region_frame(region_type, region_name, columns=default_columns, compact=True):
     try:
-        with sqlite3.connect('data/nwi_full_2019_complete.db', timeout=30) as conn:
-            if region_type == "National":
-                # For national, we still need all data, but this is explicit
-                df = pd.read_sql("""
-                    SELECT * FROM nwi_full
-                    WHERE geography_type = 'block_group'
-                """, conn)
-            elif region_type == "State":
-                df = pd.read_sql("""
-                    SELECT * FROM nwi_full
-                    WHERE geography_type = 'block_group' AND state_name = ?
-                """, conn, params=[region_name])
-            elif region_type == "County":
-                df = pd.read_sql("""
-                    SELECT * FROM nwi_full
-                    WHERE geography_type = 'block_group' AND county_name = ?
-                """, conn, params=[region_name])
-            elif region_type == "CSA":
-                df = pd.read_sql("""
-                    SELECT * FROM nwi_full
-                    WHERE geography_type = 'block_group' AND csa_name = ?
-                """, conn, params=[region_name])
-            elif region_type == "City":
-                # Handle "City, State" format - extract city and state
-                if ', ' in region_name:
-                    city_name, state_name = region_name.split(', ', 1)
-                    df = pd.read_sql("""
-                        SELECT * FROM nwi_full
-                        WHERE geography_type = 'block_group' AND city_name = ? AND state_name = ?
-                    """, conn, params=[city_name, state_name])
-                else:
-                    # Fallback for just city name
-                    df = pd.read_sql("""
-                        SELECT * FROM nwi_full
-                        WHERE geography_type = 'block_group' AND city_name = ?
-                    """, conn, params=[region_name])
-            else:
-                return pd.DataFrame()
-
-        # Add NWI Level column that the visualization functions expect
-        if not df.empty:
-            df = df.copy()
-            df["NWI Level"] = df["nwi"].map({0: 1, 1: 2, 2: 3, 3: 4})
-            # Compute Hispanic as total pop minus non-Hispanic
-            # B03002_002E = Not Hispanic total, B02001_001E = total pop
-            total = pd.to_numeric(df['b02001_001e'], errors='coerce').fillna(0)
-            non_hisp = pd.to_numeric(df['b03002_002e'], errors='coerce').fillna(0)
-            # Only compute where non-Hispanic data exists (non-zero)
-            df['b03002_012e'] = (total - non_hisp).where(non_hisp > 0, 0)
-
-        return df
+        return analytics.load_region_frame(region_type, region_name, columns, compact)
     except Exception as e:
         st.error(f"Error loading data for {region_type} {region_name}: {str(e)}")
         return pd.DataFrame()
 
-@st.cache_data
-def load_data():
-    """Load block group data with caching for performance"""
+
+@st.cache_resource
+def load_cube():
+    """Load the precomputed region cube indexed by (region_type, region), or None"""
+    return analytics.load_cube()
+
+
+@instrumented("load_region_aggregate", cache=st.cache_data)
+def load_region_aggregate(region_type, region_name):
+    """Per-NWI-level sums for one region (see analytics.region_aggregate)"""
     try:
-        with sqlite3.connect('data/nwi_full_2019_complete.db', timeout=30) as conn:
-            # Load only block group data for city aggregation
-            df = pd.read_sql("""
-                SELECT * FROM nwi_full
-                WHERE geography_type = 'block_group'
-            """, conn)
+        return analytics.region_aggregate(region_type, region_name)
     except Exception as e:
-        st.error(f"Error loading data: {str(e)}")
+        st.error(f"Error aggregating data for {region_type} {region_name}: {str(e)}")
         return pd.DataFrame()
-    
-    # Fix missing state names using FIPS codes from geoid10
-    state_fips_to_name = {
-        '01': 'Alabama', '02': 'Alaska', '04': 'Arizona', '05': 'Arkansas', '06': 'California',
-        '08': 'Colorado', '09': 'Connecticut', '10': 'Delaware', '11': 'District of Columbia',
-        '12': 'Florida', '13': 'Georgia', '15': 'Hawaii', '16': 'Idaho', '17': 'Illinois',
-        '18': 'Indiana', '19': 'Iowa', '20': 'Kansas', '21': 'Kentucky', '22': 'Louisiana',
-        '23': 'Maine', '24': 'Maryland', '25': 'Massachusetts', '26': 'Michigan', '27': 'Minnesota',
-        '28': 'Mississippi', '29': 'Missouri', '30': 'Montana', '31': 'Nebraska', '32': 'Nevada',
-        '33': 'New Hampshire', '34': 'New Jersey', '35': 'New Mexico', '36': 'New York',
-        '37': 'North Carolina', '38': 'North Dakota', '39': 'Ohio', '40': 'Oklahoma',
-        '41': 'Oregon', '42': 'Pennsylvania', '44': 'Rhode Island', '45': 'South Carolina',
-        '46': 'South Dakota', '47': 'Tennessee', '48': 'Texas', '49': 'Utah', '50': 'Vermont',
-        '51': 'Virginia', '53': 'Washington', '54': 'West Virginia', '55': 'Wisconsin',
-        '56': 'Wyoming', '72': 'Puerto Rico'
-    }
-    
-    # Standardize all state names using FIPS codes (replaces abbreviations and fills missing values)
-    df['state_name'] = df['geoid10'].str[:2].map(state_fips_to_name)
 
-    # Compute Hispanic as total pop minus non-Hispanic
-    # B03002_002E = Not Hispanic total, B02001_001E = total pop
-    total = pd.to_numeric(df['b02001_001e'], errors='coerce').fillna(0)
-    non_hisp = pd.to_numeric(df['b03002_002e'], errors='coerce').fillna(0)
-    # Only compute where non-Hispanic data exists (non-zero)
-    df['b03002_012e'] = (total - non_hisp).where(non_hisp > 0, 0)
 
-    return df
+@st.cache_data
+def load_data(columns=default_columns):
+    """Load block group data with caching for performance (columns as in load_region_data)"""
+    try:
+        return analytics.load_block_groups(columns)
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return pd.DataFrame()
 
 @st.cache_data
 def get_city_names():
     """Get cached list of available cities from block group data"""
-    with sqlite3.connect('data/nwi_full_2019_complete.db') as conn:
-        cities = pd.read_sql("""
-            SELECT DISTINCT city_name || ', ' || state_name as city_display
-            FROM nwi_full 
-            WHERE geography_type = 'block_group' 
-            AND city_name IS NOT NULL
-            ORDER BY city_display
-        """, conn)
-    return cities['city_display'].tolist()
-
-
-#@st.cache_data
+    return analytics.city_names()
+
+
+@st.cache_data
+def load_region_states(region_type):
+    """Region name -> state map for one region type, from the region dimension"""
+    try:
+        return analytics.region_states(region_type)
+    except Exception as e:
+        st.error(f"Error loading regions: {str(e)}")
+        return {}
+
+
+@instrumented("load_summary_table")
+def load_summary_table(region_type, state=None):
+    """Ranked summary table for the Tables page (memoized per process in analytics.summary_table)"""
+    try:
+        return analytics.summary_table(region_type, state)
+    except FileNotFoundError:
+        st.error(f"Summary table {analytics.summary_path(region_type)} not found. Please run build_dataset.py and generate_summary_tables.py first.")
+    except Exception as e:
+        st.error(f"Error loading summary table: {str(e)}")
+    return pd.DataFrame()
+
+
+@st.cache_resource
+def load_region_index(region_type):
+    """Name search index for one region type, built once per server process"""
+    try:
+        return analytics.region_search_index(region_type)
+    except Exception as e:
+        st.error(f"Error building the region search index: {str(e)}")
+        return analytics.RegionSearchIndex([])
+
+
+@instrumented("search_regions")
+def search_regions(region_type, query, k=REGION_MATCHES):
+    """Top k region names of region_type matching a partial, possibly misspelled query"""
+    return load_region_index(region_type).search(query, k)
+
+
+@instrumented("load_dataset", cache=st.cache_resource)
+def load_dataset():
+    """National block group frame, loaded once per server process and shared by all sessions.
+
+    Treat it as read-only: sessions keep row positions from region_rows() and
+    read their rows through current_subset() instead of holding a copy.
+    """
+    try:
+        return analytics.load_dataset()
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return pd.DataFrame()
+
+
+@instrumented("load_field_arrays", cache=st.cache_resource)
+def load_field_arrays():
+    """analytics.FieldArrays codes over the shared dataset (built once per process, no column copies)"""
+    return analytics.FieldArrays(load_dataset())
+
+
+@instrumented("region_rows", cache=st.cache_data)
+def region_rows(region_type, region_name):
+    """Positions of a region's block groups in the shared dataset"""
+    return analytics.region_positions(load_dataset(), region_type, region_name)
+
+
+
+def current_subset(columns=None):
+    """The session's selected block groups (optionally only some columns).
+
+    For the National view this is the shared dataset itself, so callers must
+    copy before modifying it.
+    """
+    dataset = load_dataset()
+    if columns is not None:
+        dataset = dataset[columns]
+    rows = st.session_state.get("rows")
+    return dataset if rows is None else dataset.iloc[rows]
+
+
+@instrumented("get_data")
 def get_data(region_type, region, table):
+    """Select the rows of table (the shared dataset) for a region in this session"""
+    block_groups = table['geography_type'] == 'block_group'
     if region_type.lower() == "national":
         # For national view, use block group data only
-        st.session_state.subset = table[table['geography_type'] == 'block_group']
+        mask = block_groups
     elif region_type.lower() == "city":
         if region is not None:
             # Parse "City, State" format
@@ -280,72 +259,51 @@ def get_data(region_type, region, table):
                 state_name = None
             
             # For specific city, use block groups within that city
+            mask = block_groups & (table['city_name'] == city_name)
             if state_name:
-                city_bgs = table[
-                    (table['geography_type'] == 'block_group') & 
-                    (table['city_name'] == city_name) &
-                    (table['state_name'] == state_name)
-                ]
-            else:
-                city_bgs = table[
-                    (table['geography_type'] == 'block_group') & 
-                    (table['city_name'] == city_name)
-                ]
+                mask &= table['state_name'] == state_name
             
-            if len(city_bgs) == 0:
+            if not mask.any():
                 st.error(f"No block groups found for city: {region}")
                 return
-            st.session_state.subset = city_bgs
         else:
             # For city selection, show all block groups that have cities
-            st.session_state.subset = table[
-                (table['geography_type'] == 'block_group') & 
-                (table['city_name'].notna())
-            ]
+            mask = block_groups & table['city_name'].notna()
     else:
         # For other region types (state, county, csa), use block group data
         region_type_label = region_type.lower() + "_name"
         if region is not None:
-            df = table[
-                (table['geography_type'] == 'block_group') & 
-                (table[region_type_label] == region)
-            ]
-            st.session_state.subset = df
+            mask = block_groups & (table[region_type_label] == region)
         else:
-            st.session_state.subset = table[table['geography_type'] == 'block_group']
+            mask = block_groups
     
-    st.session_state.subset = st.session_state.subset.copy()
-    st.session_state.subset["NWI Level"] = st.session_state.subset["nwi"].map(
-        {0: 1, 1: 2, 2: 3, 3: 4}
-    )
+    st.session_state.rows = np.flatnonzero(mask.to_numpy(dtype=bool, na_value=False))
     update_population()
     make_pop_chart()
 
 
+def selected_row_count():
+    """Number of block groups in the session's selection"""
+    rows = st.session_state.get("rows")
+    return len(load_dataset()) if rows is None else len(rows)
+
+
+def selected_region():
+    """(region_type, region_name) of the region currently loaded in the session"""
+    region_type = st.session_state.region_type
+    if region_type == "National":
+        return region_type, None
+    return region_type, st.session_state.get("current_region")
+
+
+@instrumented("update_population", rows_in=selected_row_count)
 def update_population():
-    st.session_state.nwi_population = group_by_region(
-        st.session_state.subset,
-        st.session_state.region_type.lower(),
-        st.session_state.region,
-    )
-    st.session_state.nwi_population["NWI Level"] = pd.Categorical(st.session_state.nwi_population[
-        "nwi"
-    ].map(
-        {
-            0: "1 - Least Walkable",
-            1: "2 - Below Average",
-            2: "3 - Above Average",
-            3: "4 - Most Walkable",
-        }
-    ))
-    st.session_state.nwi_population = st.session_state.nwi_population.rename(
-        columns={"b02001_001e": "Population"}
+    st.session_state.nwi_population = analytics.population_by_level(
+        load_region_aggregate(*selected_region())
     )
 
 
 def make_pop_chart():
-    # Ensure Population column is numeric
-    st.session_state.nwi_population['Population'] = pd.to_numeric(st.session_state.nwi_population['Population'], errors='coerce').fillna(0)
     st.session_state.nwi_population['Percent'] = (st.session_state.nwi_population['Population'] / st.session_state.nwi_population['Population'].sum())
     chart = (
         alt.Chart(st.session_state.nwi_population)
@@ -378,26 +336,24 @@ def make_pop_chart():
     return st.session_state.pop_chart
 
 
+@instrumented("demo_viz_b", rows_in=selected_row_count)
 def demo_viz_b(demographic):
     # This now fetches a dictionary of categories and their corresponding column names for the selected demographic
     demo_dict = field_dict[demographic]
 
     charts = []
 
+    # Every category's per-level sums in one table
+    breakdown = demographic_breakdown(load_region_aggregate(*selected_region()), demographic)
+
     # Assuming you want a separate chart for each category within the demographic
-    for category, column_name in demo_dict.items():
-        # Prepare data for the current category - need to convert TEXT to numeric and group by NWI Level
-        # Get the data and convert the column to numeric
-        df = st.session_state.subset.copy()
-        df[column_name.lower()] = pd.to_numeric(df[column_name.lower()], errors='coerce').fillna(0)
-        
-        # Group by NWI Level and sum the demographic column
-        chart_data = df.groupby("NWI Level")[column_name.lower()].sum().reset_index()
+    for category in demo_dict.keys():
+        chart_data = breakdown.loc[breakdown["Category"] == category, ["NWI Level", "Population"]]
         
         # Assuming horizontal_stacked can take this filtered DataFrame and generate a chart
         c = horizontal_stacked(
             chart_data,
-            column_name.lower(),  # The column to stack on the x-axis
+            "Population",  # The column to stack on the x-axis
             category,  # Passing the category name for labeling purposes
         )
         charts.append(c)
@@ -407,6 +363,7 @@ def demo_viz_b(demographic):
     st.altair_chart(all_charts, use_container_width=True)
 
 
+@instrumented("demo_viz_c", rows_in=selected_row_count)
 def demo_viz_c(demographic):
     # Assuming NWI levels are numerically ordered 1 through 4
     nwi_levels = range(1, 5)
@@ -415,8 +372,9 @@ def demo_viz_c(demographic):
     # Iterate through each NWI level
     for level in nwi_levels:
         # Filter data for the current NWI level
-        level_data = st.session_state.subset[
-            st.session_state.subset["NWI Level"] == level
+        subset = current_subset()
+        level_data = subset[
+            subset["NWI Level"] == level
         ]
 
         # Prepare data for the chart: for each category in the demographic, sum the population
@@ -456,12 +414,13 @@ def demo_viz_c(demographic):
     st.altair_chart(combined, use_container_width=True)
 
 
+@instrumented("demo_viz_a", rows_in=selected_row_count)
 def demo_viz_a(demographic):
     demo_dict = field_dict[demographic]
     charts = []
     for key, value in demo_dict.items():
         c = horizontal_stacked(
-            st.session_state.subset.loc[:, [value.lower(), "NWI Level"]],
+            current_subset([value.lower(), "NWI Level"]),
             value.lower(),
             key,
         )
@@ -483,30 +442,8 @@ def region_totals(df, region_type, region):
 
 
 def calculate_weighted_average_nwi():
-    # Use 'nwi_scaled_10' for the NWI ratings (1-10 scale) and 'b02001_001e' for the population counts
-    nwi_column = "nwi_scaled_10"
-    population_column = "b02001_001e"
-
-    # DataFrame for calculation
-    df = st.session_state.subset.copy()
-
-    # Ensure the relevant data are numeric
-    df[nwi_column] = pd.to_numeric(df[nwi_column], errors="coerce")
-    df[population_column] = pd.to_numeric(df[population_column], errors="coerce")
-
-    # Calculate the weighted sum of NWI ratings
-    weighted_nwi_sum = (df[nwi_column] * df[population_column]).sum()
-
-    # Calculate the total population
-    total_population = df[population_column].sum()
-
-    # Protect against division by zero if there's no population data
-    if total_population > 0:
-        weighted_average_nwi = weighted_nwi_sum / total_population
-        return weighted_average_nwi
-    else:
-        # Return a placeholder or default value (e.g., 0) if total_population is zero
-        return 0
+    # The aggregate carries the sum of 'nwi_scaled_10' (1-10 scale) x 'b02001_001e' per NWI level
+    return analytics.weighted_average_nwi(load_region_aggregate(*selected_region()))
 
 
 # @st.cache_data
@@ -520,102 +457,39 @@ def calculate_weighted_average_nwi():
 
 
 def prepare_grouped_df(region_type_name):
-    # Assuming 'st.session_state.subset' holds the DataFrame
-    df = st.session_state.subset
-
-    # Mapping NWI levels to human-readable labels
-    nwi_to_label_map = {
-        0: "1-Least",
-        1: "2-Below Avg",
-        2: "3-Above Avg",
-        3: "4-Most",
-    }
-
-    # Replace NWI numeric levels with labels
-    df["nwi_label"] = df["nwi"].map(nwi_to_label_map)
-
-    # Sum populations by region and NWI level
-    summed_df = (
-        df.groupby([region_type_name, "nwi_label"])["b02001_001e"].sum().reset_index()
+    """Ranked regions within the session's selection, summed over the shared FieldArrays"""
+    return analytics.ranked_regions(
+        load_dataset(), region_type_name, arrays=load_field_arrays(), rows=st.session_state.get("rows")
     )
 
-    # Pivot to get NWI levels as columns for each region
-    pivoted_df = summed_df.pivot(
-        index=region_type_name, columns="nwi_label", values="b02001_001e"
-    ).reset_index()
-
-    # Calculate weighted average NWI for each region  
-    weighted_averages = []
-    for region in df[region_type_name].unique():
-        region_data = df[df[region_type_name] == region]
-        avg_nwi = calculate_weighted_average_nwi_c(
-            region_data, nwi_column="nwi_scaled_10", population_column="b02001_001e"
-        )
-        weighted_averages.append({region_type_name: region, "Avg Walkability Index": avg_nwi})
-    
-    weighted_averages = pd.DataFrame(weighted_averages)
-
-    # Rename columns to match 'nwi_to_label_map' values directly if needed
-    cols_rename_map = {
-        "0": "1 - Least Walkable",
-        "1": "2 - Below Avg",
-        "2": "3 - Above Avg",
-        "3": "4 - Most Walkable",
-    }
-    pivoted_df = pivoted_df.rename(columns=cols_rename_map)
-
-    final_df = pd.merge(pivoted_df, weighted_averages, on=region_type_name)
-
-    ins_col = final_df["Avg Walkability Index"].rank(method='min', ascending=False).astype(int)
-
-    final_df.insert(0,"Rank",ins_col)
-
-    final_df = final_df.rename(columns=lambda x: 'Name' if '_name' in x else x)
-    
-    # Sort by rank with 1 at the top
-    final_df = final_df.sort_values('Rank').reset_index(drop=True)
-
-    return final_df
-
 
-def calculate_weighted_average_nwi_b(
-    df, nwi_column="nwi", population_column="b02001_001e"
-):
-    if df.empty:
-        return 0
+# Most dots the block group scatter draws; larger selections are sampled, or
+# shown as a heatmap in "Auto" style
+SCATTER_POINTS = 5000
 
-    df[nwi_column] = pd.to_numeric(df[nwi_column], errors="coerce")
-    df[population_column] = pd.to_numeric(df[population_column], errors="coerce")
 
-    weighted_nwi_sum = (df[nwi_column] * df[population_column]).sum()
-    total_population = df[population_column].sum()
-
-    if total_population > 0:
-        return weighted_nwi_sum / total_population
-    else:
-        return 0
+@instrumented("scatter_data", cache=st.cache_data)
+def scatter_data(region_type, region_name, demo_column, heatmap):
+    """Heatmap bins, or (sampled points, block groups with population), for one region.
 
+    Keyed on the region so each selection gets its own cached result; only
+    the plotted rows/bins are ever built as frames.
+    """
+    rows = None if region_type == "National" else region_rows(region_type, region_name)
+    if heatmap:
+        return analytics.scatter_density(load_dataset(), rows, demo_column)
+    return analytics.scatter_sample(load_dataset(), rows, demo_column, max_points=SCATTER_POINTS)
 
-def calculate_weighted_average_nwi_c(df, nwi_column, population_column):
-    if df.empty:
-        return 0
 
-    # Always use nwi_scaled_10 for 1-10 scale
-    nwi_column = "nwi_scaled_10"
-    nwi_values = pd.to_numeric(df[nwi_column], errors="coerce")
-    populations = pd.to_numeric(df[population_column], errors="coerce")
+@instrumented("demo_scatter_plot", rows_in=selected_row_count)
+def demo_scatter_plot(demographic, selected_metric=None, style="Auto"):
+    """Plot demographic percentage vs NWI score per block group.
 
-    weighted_nwi_sum = (nwi_values * populations).sum()
-    total_population = populations.sum()
-
-    return weighted_nwi_sum / total_population if total_population > 0 else 0
-
-
-@st.cache_data
-def demo_scatter_plot(demographic, selected_metric=None):
-    """Create scatter plot of demographic percentages vs NWI scores for each block group"""
-    df = st.session_state.subset.copy()
-    
+    style is "Points" (a scatter, sampled by NWI level above SCATTER_POINTS
+    block groups), "Heatmap" (population per percentage x score bin) or
+    "Auto" (the heatmap when the selection has more than SCATTER_POINTS block
+    groups).
+    """
     # Get demographic categories
     demo_dict = field_dict[demographic]
     
@@ -626,27 +500,25 @@ def demo_scatter_plot(demographic, selected_metric=None):
         category = list(demo_dict.keys())[0]
     
     demo_column = demo_dict[category].lower()
-    
-    # Ensure numeric data types - use nwi_scaled_10 for 1-10 scale
-    df[demo_column] = pd.to_numeric(df[demo_column], errors='coerce').fillna(0)
-    df['nwi_scaled_10'] = pd.to_numeric(df['nwi_scaled_10'], errors='coerce').fillna(0)
-    df['b02001_001e'] = pd.to_numeric(df['b02001_001e'], errors='coerce').fillna(0)
-    
-    # Calculate percentage for the demographic category
-    df['demo_percentage'] = (df[demo_column] / df['b02001_001e'] * 100).fillna(0)
-    
-    # Filter out block groups with zero population
-    df_filtered = df[df['b02001_001e'] > 0].copy()
-    
+
+    if style == "Auto":
+        style = "Heatmap" if selected_row_count() > SCATTER_POINTS else "Points"
+    if style == "Heatmap":
+        demo_heatmap(scatter_data(*selected_region(), demo_column, True), category)
+        return
+
+    df_filtered, populated = scatter_data(*selected_region(), demo_column, False)
+
     if len(df_filtered) == 0:
         st.warning("No data available for scatter plot")
         return
-    
-    # Optimize for large datasets - sample if > 5000 points
-    if len(df_filtered) > 5000:
-        df_filtered = df_filtered.sample(n=5000, random_state=42)
-        st.info(f"Showing sample of 5,000 block groups (out of {len(df)} total)")
-    
+
+    if populated > len(df_filtered):
+        st.info(
+            f"Showing a sample of {len(df_filtered):,} block groups, stratified by NWI level "
+            f"(out of {populated:,} with population)"
+        )
+
     # Adjust point size based on dataset size
     point_size = max(20, min(60, 5000 / len(df_filtered)))
     
@@ -682,39 +554,59 @@ def demo_scatter_plot(demographic, selected_metric=None):
     st.altair_chart(scatter, use_container_width=True)
 
 
+def demo_heatmap(bins, category):
+    """Heatmap of the population in each (demographic %, NWI score) bin from scatter_data"""
+    if bins.empty:
+        st.warning("No data available for scatter plot")
+        return
+    st.caption(f"Population by {category} percentage and NWI score across {bins['Block Groups'].sum():,} block groups")
+    heatmap = (
+        alt.Chart(bins)
+        .mark_rect()
+        .encode(
+            x=alt.X('pct_start:Q', bin='binned',
+                    title=f'{category} Percentage',
+                    scale=alt.Scale(domain=[0, 100])),
+            x2='pct_end:Q',
+            y=alt.Y('score_start:Q', bin='binned',
+                    title='National Walkability Index Score (1-10)',
+                    scale=alt.Scale(domain=[1, 10])),
+            y2='score_end:Q',
+            color=alt.Color('Population:Q', scale=alt.Scale(scheme='yellowgreen'),
+                            legend=alt.Legend(title="Population", format="~s")),
+            tooltip=[
+                alt.Tooltip('pct_start:Q', title=f'{category} % from', format='.0f'),
+                alt.Tooltip('pct_end:Q', title=f'{category} % to', format='.0f'),
+                alt.Tooltip('score_start:Q', title='NWI Score from', format='.1f'),
+                alt.Tooltip('score_end:Q', title='NWI Score to', format='.1f'),
+                alt.Tooltip('Population:Q', title='Population', format=','),
+                alt.Tooltip('Block Groups:Q', title='Block Groups', format=','),
+            ]
+        )
+        .properties(
+            title=f'{category} Percentage vs NWI Score by Block Group',
+            width=700,
+            height=400
+        )
+    )
+    st.altair_chart(heatmap, use_container_width=True)
+
+
+@instrumented("demo_viz_d", rows_in=selected_row_count)
 def demo_viz_d(demographic):
     # Assuming NWI levels are numerically ordered 1 through 4
     nwi_levels = range(1, 5)
     charts = []
 
+    # Every category's sums and within-level percentages in one table
+    breakdown = demographic_breakdown(load_region_aggregate(*selected_region()), demographic)
+
     # Iterate through each NWI level
     for level in nwi_levels:
-        # Filter data for the current NWI level
-        level_data = st.session_state.subset[
-            st.session_state.subset["NWI Level"] == level
-        ].copy()
-
-        # Prepare data for the chart: for each category in the demographic, sum the population
-        category_data = []
-        total_population = 0
-        for category, column_name in field_dict[demographic].items():
-            # Convert TEXT to numeric before summing
-            level_data[column_name.lower()] = pd.to_numeric(level_data[column_name.lower()], errors='coerce').fillna(0)
-            # Summing up for the current level for each category
-            category_sum = level_data[column_name.lower()].sum()
-            category_data.append({"Category": category, "Population": category_sum})
-            total_population += category_sum
-
-        # Now calculate the percentage for each category relative to the total population of this level
-        for item in category_data:
-            item["Percentage"] = (
-                (item["Population"] / total_population) * 100
-                if total_population > 0
-                else 0
-            )
-
-        # Convert aggregated data to DataFrame
-        df_chart = pd.DataFrame(category_data)
+        # Percentage for each category relative to the total population of this level
+        df_chart = breakdown.loc[
+            breakdown["NWI Level"] == level, ["Category", "Population", "Level Percentage"]
+        ].rename(columns={"Level Percentage": "Percentage"})
 
         # Generate chart for this NWI level with normalized bars
         chart = (
@@ -748,3 +640,80 @@ def demo_viz_d(demographic):
     # Combining all charts vertically
     combined = alt.vconcat(*charts, spacing=20)
     st.altair_chart(combined, use_container_width=True)
+
+
+@instrumented("load_comparison", cache=st.cache_data)
+def load_comparison(regions, demographics=()):
+    """Summary and demographic breakdowns for several regions (see analytics.compare_regions).
+
+    regions is a tuple of (region_type, region) pairs, all aggregated in one pass.
+    """
+    try:
+        return analytics.compare_regions(list(regions), list(demographics))
+    except Exception as e:
+        st.error(f"Error comparing regions: {str(e)}")
+        return pd.DataFrame(), pd.DataFrame()
+
+
+def compare_viz(summary):
+    """Side-by-side population share by NWI level and weighted NWI for each compared region"""
+    order = list(summary["Region"])
+    levels = [analytics.nwi_level_names[level] for level in range(4)]
+    tidy = summary[["Region Type", "Region"] + levels].melt(
+        id_vars=["Region Type", "Region"], var_name="NWI Level", value_name="Population"
+    )
+    tidy["Percent"] = tidy["Population"] / tidy.groupby("Region")["Population"].transform("sum")
+
+    shares = (
+        alt.Chart(tidy)
+        .mark_bar()
+        .encode(
+            x=alt.X("Population:Q", stack="normalize", title="Share of Population", axis=alt.Axis(format="%")),
+            y=alt.Y("Region:N", sort=order, title=None),
+            color=alt.Color("NWI Level:N", scale=alt.Scale(domain=levels, range=colors),
+                            legend=alt.Legend(orient="bottom", title=None)),
+            order=alt.Order("NWI Level:N"),
+            tooltip=["Region", "Region Type", "NWI Level", alt.Tooltip("Population", format=","),
+                     alt.Tooltip("Percent", format=".1%")],
+        )
+        .properties(title="Population by NWI Level", height=alt.Step(30))
+    )
+    weighted = (
+        alt.Chart(summary)
+        .mark_bar(color="steelblue")
+        .encode(
+            x=alt.X("Weighted NWI:Q", title="Population-Weighted Mean Walkable Land Use", scale=alt.Scale(domain=[0, 10])),
+            y=alt.Y("Region:N", sort=order, title=None),
+            tooltip=["Region", "Region Type", alt.Tooltip("Weighted NWI", format=".2f"),
+                     alt.Tooltip("Population", format=",")],
+        )
+        .properties(height=alt.Step(30))
+    )
+    text = weighted.mark_text(align="left", baseline="middle", dx=5, color="grey").encode(
+        text=alt.Text("Weighted NWI:Q", format=".1f")
+    )
+    st.altair_chart(alt.vconcat(shares, weighted + text, spacing=30), use_container_width=True)
+
+
+def compare_demo_viz(breakdowns, demographic, order):
+    """Each category's population share by NWI level, one bar per compared region"""
+    chart_data = breakdowns[breakdowns["Demographic"] == demographic].copy()
+    chart_data["NWI Level"] = chart_data["NWI Level"].map(lambda level: analytics.nwi_level_names[level - 1])
+    levels = [analytics.nwi_level_names[level] for level in range(4)]
+    chart = (
+        alt.Chart(chart_data)
+        .mark_bar()
+        .encode(
+            x=alt.X("Population:Q", stack="normalize", title=None, axis=alt.Axis(format="%")),
+            y=alt.Y("Region:N", sort=order, title=None),
+            color=alt.Color("NWI Level:N", scale=alt.Scale(domain=levels, range=colors),
+                            legend=alt.Legend(orient="bottom", title=None)),
+            order=alt.Order("NWI Level:N"),
+            row=alt.Row("Category:N", sort=list(field_dict[demographic].keys()), title=None,
+                        header=alt.Header(labelAngle=0, labelAlign="left")),
+            tooltip=["Region", "Category", "NWI Level", alt.Tooltip("Population", format=",.0f"),
+                     alt.Tooltip("Category Percentage", format=".1f", title="Percent of Category")],
+        )
+        .properties(title=f"Walkable Land Use by {demographic}", height=alt.Step(16))
+    )
+    st.altair_chart(chart, use_container_width=True)
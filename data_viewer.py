@@ -1,20 +1,34 @@
+import os
 import streamlit as st
 import pandas as pd
 import numpy as np
+from analytics import summary_path
 from config import demo_cats, field_dict
 from data_handler import (
     get_data,
     load_data,
+    load_dataset,
     load_region_lists,
-    load_region_data,
+    load_region_states,
+    load_summary_table,
+    load_comparison,
+    region_rows,
+    search_regions,
     make_pop_chart,
     update_population,
     demo_viz_b,
     demo_viz_d,
     demo_scatter_plot,
+    compare_viz,
+    compare_demo_viz,
     calculate_weighted_average_nwi,
     prepare_grouped_df,
+    stale_build_artifacts,
 )
+from diagnostics import diagnostics_panel
+
+# Log generated artifacts that are out of date with the database (checked once per process)
+stale_artifacts = stale_build_artifacts()
 
 # ----------- Session State Initialization (fixes infinite loop) -----------
 if "region_type" not in st.session_state:
@@ -25,21 +39,18 @@ if "region" not in st.session_state:
 if "region_lists" not in st.session_state:
     with st.spinner("Loading region lists..."):
         st.session_state.region_lists = load_region_lists()
-# Don't load full data until needed
-if "table" not in st.session_state:
-    with st.spinner("Loading data..."):
-        if st.session_state.region_type == "National":
-            st.session_state.table = load_region_data("National", None)
-        else:
-            st.session_state.table = pd.DataFrame()  # Empty until region selected
-if "subset" not in st.session_state:
-    st.session_state.subset = st.session_state.table.copy() if not st.session_state.table.empty else pd.DataFrame()
+# The block group data is held once per server process (load_dataset) and shared
+# by all sessions; a session only keeps the row positions of its selected region
+with st.spinner("Loading data..."):
+    load_dataset()
+if "rows" not in st.session_state:
+    st.session_state.rows = None  # None = every block group (National)
 # --------------------------------------------------------------------------
 
 with st.sidebar:
     st.image('AW_logo_horizontal_full_color.png')
     st.markdown("### Walkable Land Use Analysis")
-    page = st.sidebar.selectbox("Choose a page", ["Main Page", "Tables"])
+    page = st.sidebar.selectbox("Choose a page", ["Main Page", "Tables", "Compare"])
     st.markdown(
         "##### Data Sources:\n- [American Community Survey](https://www.census.gov/data/developers/data-sets/acs-5year.html)  \n *A U.S. Census survey that provides information on a yearly basis about our nation and its people*\n- [National Walkability Index](https://www.epa.gov/smartgrowth/smart-location-mapping)  \n *A resource of the EPA that ranks U.S. Census block groups according to their relative walkability.*"
     )
@@ -55,24 +66,9 @@ with st.sidebar:
 
 if page == "Main Page":
 
-    # Calculate NWI levels based on natwalkind if nwi is null (do this once, not every page load)
-    if "nwi_calculated" not in st.session_state:
-        if st.session_state.table["nwi"].isnull().all():
-            quantiles = st.session_state.table["natwalkind"].quantile([0.25, 0.5, 0.75])
-            conditions = [
-                st.session_state.table["natwalkind"] <= quantiles[0.25],
-                (st.session_state.table["natwalkind"] > quantiles[0.25]) & (st.session_state.table["natwalkind"] <= quantiles[0.5]),
-                (st.session_state.table["natwalkind"] > quantiles[0.5]) & (st.session_state.table["natwalkind"] <= quantiles[0.75]),
-                st.session_state.table["natwalkind"] > quantiles[0.75]
-            ]
-            choices = [0, 1, 2, 3]
-            st.session_state.table.loc[:, "nwi"] = np.select(conditions, choices, default=3)
-        else:
-            st.session_state.table.loc[:, "nwi"] = st.session_state.table["nwi"].fillna(3)
-        st.session_state.nwi_calculated = True
-
     # Only update charts if we have data
-    if not st.session_state.table.empty:
+    data_loaded = st.session_state.region_type == "National" or st.session_state.get('current_region') is not None
+    if data_loaded:
         update_population()
         make_pop_chart()
 
@@ -86,14 +82,12 @@ if page == "Main Page":
 
     # Handle region selection and data loading
     if st.session_state.region_type.lower() == "national":
-        # When switching to National, load national data if needed
-        if st.session_state.get('current_region') is not None or st.session_state.table.empty:
-            with st.spinner("Loading national data..."):
-                st.session_state.table = load_region_data("National", None)
-                st.session_state.subset = st.session_state.table.copy() if not st.session_state.table.empty else pd.DataFrame()
-                if 'current_region' in st.session_state:
-                    del st.session_state.current_region
-                st.rerun()
+        # When switching to National, select every block group again
+        if st.session_state.get('current_region') is not None or st.session_state.rows is not None:
+            st.session_state.rows = None
+            if 'current_region' in st.session_state:
+                del st.session_state.current_region
+            st.rerun()
     else:
         # Region selection using cached lists
         region_type_lower = st.session_state.region_type.lower()
@@ -108,22 +102,36 @@ if page == "Main Page":
         else:
             names = []
 
+        query = ""
+        if names and region_type_lower in ("county", "city"):
+            # Too many names for one dropdown: offer the best matches for the search text
+            query = st.text_input(
+                f"Search {st.session_state.region_type.lower()} names",
+                key=f"region_search_{region_type_lower}",
+                placeholder="Start typing a name (typos are OK)",
+            )
+            names = search_regions(st.session_state.region_type, query)
+            current = st.session_state.get('current_region')
+            if current in load_region_states(st.session_state.region_type) and current not in names:
+                # Keep the current selection available while searching for another
+                names = [current] + names
+
         if names:
             selected_region = st.selectbox("Select Region", names, index=None, key="region")
 
             # Load new data when region changes
             if selected_region and selected_region != st.session_state.get('current_region'):
                 with st.spinner(f"Loading data for {selected_region}..."):
-                    st.session_state.table = load_region_data(st.session_state.region_type, selected_region)
-                    st.session_state.subset = st.session_state.table.copy() if not st.session_state.table.empty else pd.DataFrame()
+                    st.session_state.rows = region_rows(st.session_state.region_type, selected_region)
                     st.session_state.current_region = selected_region
                     st.rerun()
             elif not selected_region:
                 # No region selected, show empty state
-                st.session_state.table = pd.DataFrame()
-                st.session_state.subset = pd.DataFrame()
+                st.session_state.rows = np.empty(0, dtype=np.intp)
                 if 'current_region' in st.session_state:
                     del st.session_state.current_region
+        elif query:
+            st.write(f"No regions match '{query}'")
         else:
             st.write("No regions available for this type")
 
@@ -131,7 +139,7 @@ if page == "Main Page":
     if (st.session_state.region_type == "National" or
         (st.session_state.region_type != "National" and
          st.session_state.get('current_region') is not None)) and \
-       not st.session_state.table.empty:
+       (st.session_state.rows is None or len(st.session_state.rows) > 0):
         weighted_average_nwi = calculate_weighted_average_nwi()
         st.metric(label="Population-Weighted Mean Walkable Land Use", value=round(weighted_average_nwi, 1))
         st.altair_chart(st.session_state.pop_chart, use_container_width=True)
@@ -152,7 +160,14 @@ if page == "Main Page":
                 metric_options,
                 key=f"scatter_metric_{demographic}_{st.session_state.region_type}_{st.session_state.region}"
             )
-            demo_scatter_plot(demographic, selected_metric)
+            scatter_style = st.radio(
+                "Plot style",
+                ["Auto", "Points", "Heatmap"],
+                horizontal=True,
+                help="Auto shows a population heatmap for regions with more than 5,000 block groups",
+                key="scatter_style",
+            )
+            demo_scatter_plot(demographic, selected_metric, scatter_style)
 
             st.subheader("Aggregate Analysis")
             # Only show barplots for the main demographic category (first metric)
@@ -177,10 +192,7 @@ elif page == "Tables":
 
     state_filter = None
     if region_type_selected.lower() in ["county", "city"]:
-        available_states = sorted(st.session_state.table[
-            (st.session_state.table['geography_type'] == 'block_group') &
-            (st.session_state.table['state_name'].notna())
-        ]['state_name'].unique())
+        available_states = st.session_state.region_lists['states']
         plural_name = "counties" if region_type_selected.lower() == "county" else "cities"
         state_filter = st.selectbox(
             f"Filter {plural_name} by state (optional):",
@@ -190,30 +202,72 @@ elif page == "Tables":
         if state_filter == "All States":
             state_filter = None
 
-    region_lower = region_type_selected.lower()
-    if region_lower == "county":
-        plural_name = "counties"
-    elif region_lower == "city":
-        plural_name = "cities"
-    else:
-        plural_name = f"{region_lower}s"
-    
-    summary_filename = f"data/summary_{plural_name}.csv"
-    
-    try:
-        prepared_df = pd.read_csv(summary_filename)
-        if state_filter is not None and region_type_selected.lower() in ["county", "city"]:
-            if region_type_selected.lower() == "city":
-                prepared_df = prepared_df[prepared_df['Name'].str.endswith(f', {state_filter}')]
-            else:
-                block_data = st.session_state.table[st.session_state.table['geography_type'] == 'block_group']
-                county_state_map = block_data[['county_name', 'state_name']].drop_duplicates()
-                county_state_map = dict(zip(county_state_map['county_name'], county_state_map['state_name']))
-                prepared_df = prepared_df[
-                    prepared_df['Name'].map(county_state_map) == state_filter
-                ].copy()
-    except FileNotFoundError:
-        st.error(f"Summary table {summary_filename} not found. Please run generate_summary_tables.py first.")
+    summary_filename = summary_path(region_type_selected)
+
+    stale_reason = stale_artifacts.get(os.path.basename(summary_filename))
+    if stale_reason:
+        # Don't show rankings computed from an older version of the data
+        st.error(f"Summary table {summary_filename} is out of date ({stale_reason}). Please run generate_summary_tables.py.")
         prepared_df = pd.DataFrame()
+    else:
+        prepared_df = load_summary_table(region_type_selected, state_filter)
+        if region_type_selected == "State":
+            prepared_df = prepared_df.drop(columns="State", errors="ignore")
+
+    st.dataframe(prepared_df, hide_index=True, use_container_width=True)
+
+elif page == "Compare":
+    st.title("Compare Regions")
+
+    # (region_type, region) pairs in the order they were added, across region types
+    if "compare_selection" not in st.session_state:
+        st.session_state.compare_selection = []
+
+    include_national = st.checkbox("Include the United States", value=True, key="compare_national")
+    compare_type = st.selectbox(
+        "Add regions of type", options=["State", "County", "CSA", "City"], key="compare_type"
+    )
+    selected = [region for region_type, region in st.session_state.compare_selection if region_type == compare_type]
+    if compare_type in ("County", "City"):
+        query = st.text_input(
+            f"Search {compare_type.lower()} names",
+            key=f"compare_search_{compare_type.lower()}",
+            placeholder="Start typing a name (typos are OK)",
+        )
+        # Regions already being compared stay available while searching for more
+        options = list(dict.fromkeys(selected + search_regions(compare_type, query)))
+        if query and not options:
+            st.write(f"No regions match '{query}'")
+    else:
+        options = st.session_state.region_lists["states" if compare_type == "State" else "csas"]
+    chosen = st.multiselect(f"{compare_type} regions to compare", options, default=selected)
+
+    # Keep the other types' regions and the order regions were added in
+    st.session_state.compare_selection = [
+        (region_type, region) for region_type, region in st.session_state.compare_selection
+        if region_type != compare_type or region in chosen
+    ] + [(compare_type, region) for region in chosen if region not in selected]
+
+    regions = ([("National", None)] if include_national else []) + st.session_state.compare_selection
+    if not regions:
+        st.write("Select regions to compare")
+    else:
+        summary, breakdowns = load_comparison(tuple(regions), tuple(field_dict))
+        if summary.empty:
+            st.write("No data for the selected regions")
+        else:
+            compare_viz(summary)
+            st.dataframe(
+                summary.style.format({"Weighted NWI": "{:.2f}"}, thousands=",", precision=0),
+                hide_index=True, use_container_width=True,
+            )
+
+            demographic = st.selectbox(
+                "Compare by", list(demo_cats.keys()), index=None, key="compare_demographic"
+            )
+            if demographic:
+                st.write(demo_cats[demographic])
+                compare_demo_viz(breakdowns, demographic, list(summary["Region"]))
 
-    st.dataframe(prepared_df, hide_index=True, use_container_width=True)
\ No newline at end of file
+# Timing records for this session (only with NWI_DIAGNOSTICS=1 or ?diagnostics=1)
+diagnostics_panel()
@@ -0,0 +1,187 @@
+"""
+Opt-in timing instrumentation for the data_handler entry points.
+
+Turn it on with the NWI_DIAGNOSTICS=1 environment variable (every session)
+or by opening the app with ?diagnostics=1 (that session only). Each call to
+an @instrumented function then records its wall time, rows in and out,
+bytes of the returned frame and whether a Streamlit cache answered it. The
+records are shown in the sidebar's Diagnostics section, can be downloaded
+from there as JSON lines, and are logged as one JSON object per call on the
+"diagnostics" logger; set NWI_DIAGNOSTICS_LOG=path to append them to a file
+for offline analysis.
+
+When diagnostics are off the wrappers only check the flag and call through.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import pandas as pd
+import streamlit as st
+
+logger = logging.getLogger("diagnostics")
+if os.environ.get("NWI_DIAGNOSTICS_LOG") and not logger.handlers:
+    _handler = logging.FileHandler(os.environ["NWI_DIAGNOSTICS_LOG"])
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# Records kept per session for the panel (oldest dropped first)
+MAX_RECORDS = 500
+
+# Calls in progress on this thread, innermost last; the cache-wrapped body
+# marks the innermost one so the wrapper can tell a cache miss from a hit
+_calls = threading.local()
+
+
+def enabled():
+    """True if this session asked for diagnostics (env var or ?diagnostics=1)"""
+    if os.environ.get("NWI_DIAGNOSTICS") == "1":
+        return True
+    try:
+        if st.query_params.get("diagnostics") == "1":
+            st.session_state.diagnostics_enabled = True
+        return st.session_state.get("diagnostics_enabled", False)
+    except Exception:
+        # Not running inside a Streamlit session (e.g. a batch script)
+        return False
+
+
+def _session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+
+def _rows(value):
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+def _describe_args(args, kwargs):
+    """Short, loggable description of the call arguments (frames by shape)"""
+    def describe(value):
+        if isinstance(value, pd.DataFrame):
+            return f"<DataFrame {value.shape[0]}x{value.shape[1]}>"
+        text = repr(value)
+        return text if len(text) <= 60 else text[:57] + "..."
+    parts = [describe(value) for value in args]
+    parts += [f"{name}={describe(value)}" for name, value in kwargs.items()]
+    return ", ".join(parts)
+
+
+def record(entry):
+    """Keep entry for this session's panel and write it to the diagnostics log"""
+    try:
+        records = st.session_state.setdefault("diagnostics", deque(maxlen=MAX_RECORDS))
+        records.append(entry)
+    except Exception:
+        pass
+    logger.info(json.dumps(entry, default=str))
+
+
+def instrumented(name, cache=None, rows_in=None):
+    """Decorator timing calls to name when diagnostics are enabled.
+
+    cache is the Streamlit cache decorator the function would otherwise be
+    decorated with (st.cache_data / st.cache_resource); it is applied here so
+    the wrapper can see whether the function body actually ran. rows_in is a
+    callable giving the input row count for functions that read the session's
+    selection instead of taking a frame.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            stack = getattr(_calls, "stack", None)
+            if stack:
+                stack[-1]["computed"] = True
+            return func(*args, **kwargs)
+
+        target = cache(compute) if cache is not None else compute
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_calls, "quiet", False) or not enabled():
+                return target(*args, **kwargs)
+            stack = _calls.__dict__.setdefault("stack", [])
+            stack.append({"computed": False})
+            start = time.perf_counter()
+            try:
+                result = target(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                call = stack.pop()
+            if rows_in is not None:
+                # Calls made while counting the input rows aren't recorded
+                _calls.quiet = True
+                try:
+                    count_in = rows_in()
+                finally:
+                    _calls.quiet = False
+            else:
+                count_in = next((len(value) for value in args if isinstance(value, pd.DataFrame)), None)
+            # A cache hit loads nothing, so only frames that were built are measured
+            loaded_bytes = None
+            if isinstance(result, pd.DataFrame) and (cache is None or call["computed"]):
+                loaded_bytes = int(result.memory_usage(deep=True).sum())
+            record({
+                "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                "session": _session_id(),
+                "function": name,
+                "args": _describe_args(args, kwargs),
+                "seconds": round(seconds, 6),
+                "rows_in": count_in,
+                "rows_out": _rows(result),
+                "bytes": loaded_bytes,
+                "cache": None if cache is None else ("miss" if call["computed"] else "hit"),
+            })
+            return result
+
+        if hasattr(target, "clear"):
+            wrapper.clear = target.clear
+        return wrapper
+    return decorate
+
+
+def diagnostics_panel():
+    """Sidebar section with this session's records, a per-function summary and a JSON lines export"""
+    if not enabled():
+        return
+    records = list(st.session_state.get("diagnostics", []))
+    with st.sidebar.expander("Diagnostics", expanded=False):
+        if not records:
+            st.write("No calls recorded yet.")
+            return
+        df = pd.DataFrame(records)
+        summary = df.groupby("function").agg(
+            calls=("seconds", "size"),
+            total_s=("seconds", "sum"),
+            mean_ms=("seconds", lambda s: s.mean() * 1000),
+            max_ms=("seconds", lambda s: s.max() * 1000),
+            cache_hits=("cache", lambda s: (s == "hit").sum()),
+        ).sort_values("total_s", ascending=False)
+        st.markdown("**By function**")
+        st.dataframe(summary, use_container_width=True)
+        st.markdown("**Recent calls**")
+        st.dataframe(
+            df[["function", "args", "seconds", "rows_in", "rows_out", "bytes", "cache"]].iloc[::-1],
+            hide_index=True, use_container_width=True,
+        )
+        st.download_button(
+            "Download log (JSON lines)",
+            "\n".join(json.dumps(entry, default=str) for entry in records) + "\n",
+            file_name="nwi_diagnostics.jsonl",
+            mime="application/json",
+        )
+        if st.button("Clear diagnostics"):
+            st.session_state.diagnostics = deque(maxlen=MAX_RECORDS)
+            st.rerun()
@@ -1,52 +1,55 @@
 #!/usr/bin/env python3
 """
 Script to pre-compute summary tables for the Tables page.
-This generates separate CSV files for States, Counties, CSAs, and Cities
-instead of calculating them on-the-fly from block group data.
+This generates separate Parquet tables for States, Counties, CSAs, and Cities
+instead of calculating them on-the-fly from block group data. Each row also
+has the region's State, and each state's rows are stored as their own row
+group so the Tables page's state filter reads only that state.
+It also writes the region cube that the Main Page charts read from and the
+region dimension (every region's name, state and size) behind the dropdowns.
+
+The block group data is loaded once and shared read-only with a pool of
+forked worker processes, one table per task:
+
+    python generate_summary_tables.py --jobs 4
+
+Only tables whose inputs changed since the last run (including the method
+NWI levels are classified by) are rebuilt (see build_manifest.py); pass --force to rebuild everything.
 """
 
+import argparse
+import build_manifest
+import multiprocessing
+import numpy as np
 import pandas as pd
 import sqlite3
-from data_handler import load_data, calculate_weighted_average_nwi_c
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from analytics import (
+    CUBE_PATH,
+    DB_PATH,
+    REGIONS_PATH,
+    build_region_dimension,
+    field_columns,
+    load_dataset,
+    nwi_method,
+    region_key,
+    region_types,
+    state_names_from_fips,
+    summarize_regions,
+    summary_population_columns,
+)
 import os
 
+# Block group frame shared with forked workers (set once in main, never modified)
+_shared_df = None
+
 def create_summary_table(df, region_type_name, output_filename):
-    """Create a summary table for a given region type and save to CSV"""
+    """Create a summary table for a given region type and save it to Parquet"""
     print(f"Generating {output_filename}...")
     
-    # Mapping NWI levels to human-readable labels
-    nwi_to_label_map = {
-        0: "1-Least",
-        1: "2-Below Avg", 
-        2: "3-Above Avg",
-        3: "4-Most",
-    }
-
-    # Replace NWI numeric levels with labels
-    df["nwi_label"] = df["nwi"].map(nwi_to_label_map)
-
-    # Sum populations by region and NWI level
-    summed_df = (
-        df.groupby([region_type_name, "nwi_label"])["b02001_001e"].sum().reset_index()
-    )
-
-    # Pivot to get NWI levels as columns for each region
-    pivoted_df = summed_df.pivot(
-        index=region_type_name, columns="nwi_label", values="b02001_001e"
-    ).reset_index()
-
-    # Calculate weighted average NWI for each region  
-    weighted_averages = []
-    for region in df[region_type_name].unique():
-        if pd.isna(region):
-            continue
-        region_data = df[df[region_type_name] == region]
-        avg_nwi = calculate_weighted_average_nwi_c(
-            region_data, nwi_column="nwi_scaled_10", population_column="b02001_001e"
-        )
-        weighted_averages.append({region_type_name: region, "Avg Walkability Index": avg_nwi})
-    
-    weighted_averages = pd.DataFrame(weighted_averages)
+    # Population pivot, weighted average and rank for all regions in one pass
+    final_df = summarize_regions(df, region_type_name)
 
     # Rename columns to match display format
     cols_rename_map = {
@@ -55,13 +58,11 @@ def create_summary_table(df, region_type_name, output_filename):
         "3-Above Avg": "3 - Above Avg", 
         "4-Most": "4 - Most Walkable",
     }
-    pivoted_df = pivoted_df.rename(columns=cols_rename_map)
-
-    # Merge with weighted averages
-    final_df = pd.merge(pivoted_df, weighted_averages, on=region_type_name)
-
-    # Add ranking
-    final_df["Rank"] = final_df["Avg Walkability Index"].rank(method='min', ascending=False).astype(int)
+    final_df = final_df.rename(columns=cols_rename_map)
+    # Every level gets a column, even one no region has block groups at
+    final_df = final_df.reindex(
+        columns=[region_type_name] + summary_population_columns + ["Avg Walkability Index", "Rank"]
+    )
 
     # Reorder columns to put Rank first
     cols = ["Rank"] + [col for col in final_df.columns if col != "Rank"]
@@ -73,52 +74,186 @@ def create_summary_table(df, region_type_name, output_filename):
     # Sort by rank with 1 at the top
     final_df = final_df.sort_values('Rank').reset_index(drop=True)
     
-    # Fill NaN values with 0 for population columns
-    population_cols = ["1 - Least Walkable", "2 - Below Avg", "3 - Above Avg", "4 - Most Walkable"]
-    final_df[population_cols] = final_df[population_cols].fillna(0)
+    # Fill NaN values with 0 for population columns (whole numbers, so stored as integers)
+    population_cols = summary_population_columns
+    final_df[population_cols] = final_df[population_cols].fillna(0).astype("int64")
+
+    # Each region's state is the one holding most of its block groups, so the
+    # Tables page can filter by state without the block group data
+    counts = pd.DataFrame({"region": df[region_type_name], "state": df["fips_state_name"]}).value_counts()
+    states = (
+        counts.rename("block_groups").reset_index().sort_values("block_groups", ascending=False, kind="stable")
+        .drop_duplicates("region").set_index("region")["state"]
+    )
+    final_df["State"] = final_df["Name"].map(states)
     
-    # Save to CSV
     output_path = f"data/{output_filename}"
-    final_df.to_csv(output_path, index=False)
+    write_summary_table(final_df, output_path)
     print(f"Saved {len(final_df)} rows to {output_path}")
     
     return final_df
 
+
+def write_summary_table(final_df, output_path):
+    """Write a summary table to Parquet with one row group per state.
+
+    Rows are grouped by state (in rank order within each state) so a reader
+    filtering on State only has to decode that state's row group.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    by_state = final_df.sort_values("State", kind="stable", na_position="last").reset_index(drop=True)
+    table = pa.Table.from_pandas(by_state, preserve_index=False)
+    states = by_state["State"].fillna("")
+    starts = list(np.flatnonzero(states.ne(states.shift()))) + [len(by_state)]
+
+    tmp_path = f"{output_path}.tmp"
+    with pq.ParquetWriter(tmp_path, table.schema, compression="zstd") as writer:
+        for start, end in zip(starts[:-1], starts[1:]):
+            writer.write_table(table.slice(start, end - start))
+    os.replace(tmp_path, output_path)
+
+def write_parquet(df, output_path):
+    """Write a frame to Parquet through a temporary file, like write_summary_table.
+
+    The app never reads a half-written file, and a crashed build leaves the
+    previous version in place.
+    """
+    tmp_path = f"{output_path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+
+
+def create_region_cube(df):
+    """Sum every config.fields column per (region_type, region, nwi) and save to Parquet
+
+    Expects NWI levels classified by load_dataset() and the nwi_weighted
+    column (nwi_scaled_10 x population) added in main().
+    Region names match load_region_lists() (raw state names, "City, State" for
+    cities) so load_region_aggregate() can look up any dropdown selection.
+    """
+    print(f"Generating {CUBE_PATH}...")
+    nwi = df["nwi"].astype(int)
+    sum_columns = field_columns + ["nwi_weighted"]
+
+    region_keys = {region_type: region_key(df, region_type) for region_type in region_types}
+    parts = []
+    for region_type, key in region_keys.items():
+        summed = df.groupby([key.rename("region"), nwi])[sum_columns].sum().reset_index()
+        summed.insert(0, "region_type", region_type)
+        parts.append(summed)
+    cube = pd.concat(parts, ignore_index=True)
+
+    write_parquet(cube, CUBE_PATH)
+    print(f"Saved {len(cube):,} rows to {CUBE_PATH}")
+    return cube
+
+
+def create_region_dimension(df):
+    """Save the region dimension (names, states and sizes) the dropdowns and filters read"""
+    print(f"Generating {REGIONS_PATH}...")
+    dimension = build_region_dimension(df)
+    write_parquet(dimension, REGIONS_PATH)
+    print(f"Saved {len(dimension):,} rows to {REGIONS_PATH}")
+    return dimension
+
+
+# Each job is (artifact, builder, region column); builders only read the shared frame
+jobs = [
+    (os.path.basename(CUBE_PATH), "cube", None),
+    (os.path.basename(REGIONS_PATH), "regions", None),
+    ("summary_states.parquet", "summary", "fips_state_name"),
+    ("summary_counties.parquet", "summary", "county_name"),
+    ("summary_csas.parquet", "summary", "csa_name"),
+    ("summary_cities.parquet", "summary", "city_state"),
+]
+
+
+def run_job(job):
+    """Build one artifact from the shared frame and return (name, rows, seconds)"""
+    name, builder, region_column = job
+    start = time.perf_counter()
+    if builder == "cube":
+        result = create_region_cube(_shared_df)
+    elif builder == "regions":
+        result = create_region_dimension(_shared_df)
+    else:
+        # Rows without a region name are dropped by the grouped sums, so no filtered copy is needed
+        result = create_summary_table(_shared_df, region_column, name)
+    return name, len(result), time.perf_counter() - start
+
+
+def table_inputs():
+    """Manifest inputs of the tables: the build_manifest inputs plus the classify_nwi method,
+    which the tables' NWI levels depend on"""
+    return dict(build_manifest.current_inputs(DB_PATH), nwi_classification=nwi_method())
+
+
+def load_table_frame():
+    """Every block group with the columns the tables and cube are built from.
+
+    Raw region names key the cube (they match the Main Page dropdowns); the
+    summary tables use state names standardized from the geoid10 FIPS code.
+    NWI levels are classified like the app's dataset whether or not there is
+    a snapshot.
+    """
+    df = load_dataset(compact=False)
+    df["fips_state_name"] = state_names_from_fips(df["geoid10"])
+    df["city_state"] = df["city_name"] + ", " + df["fips_state_name"]
+    df["nwi_weighted"] = df["nwi_scaled_10"] * df["b02001_001e"]
+    return df
+
+
 def main():
     """Generate all summary tables"""
+    global _shared_df
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--jobs", type=int, default=min(len(jobs), os.cpu_count() or 1),
+        help="worker processes to build tables with (1 = build sequentially in this process)",
+    )
+    parser.add_argument("--force", action="store_true", help="rebuild every table even if its inputs are unchanged")
+    args = parser.parse_args()
+
+    inputs = table_inputs()
+    stale = build_manifest.stale_artifacts([name for name, _, _ in jobs], inputs)
+    todo = jobs if args.force else [job for job in jobs if job[0] in stale]
+    if not todo:
+        print("All summary tables are up to date (use --force to rebuild)")
+        return
+    for name, _, _ in todo:
+        print(f"Rebuilding {name}: {stale.get(name, 'forced')}")
+
     print("Loading block group data...")
-    df = load_data()
-    
-    # Filter to block groups only
-    df = df[df['geography_type'] == 'block_group'].copy()
-    print(f"Loaded {len(df):,} block group records")
-    
+    start = time.perf_counter()
+    df = load_table_frame()
+    _shared_df = df
+    print(f"Loaded {len(df):,} block group records in {time.perf_counter() - start:.1f}s")
+
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
-    
-    # Generate States table
-    states_df = df[df['state_name'].notna()].copy()
-    create_summary_table(states_df, "state_name", "summary_states.csv")
-    
-    # Generate Counties table  
-    counties_df = df[df['county_name'].notna()].copy()
-    create_summary_table(counties_df, "county_name", "summary_counties.csv")
-    
-    # Generate CSAs table
-    csa_df = df[df['csa_name'].notna()].copy() 
-    create_summary_table(csa_df, "csa_name", "summary_csas.csv")
-    
-    # Generate Cities table (with city, state format)
-    cities_df = df[(df['city_name'].notna()) & (df['state_name'].notna())].copy()
-    cities_df['city_state'] = cities_df['city_name'] + ', ' + cities_df['state_name']
-    create_summary_table(cities_df, "city_state", "summary_cities.csv")
-    
-    print("\n✅ All summary tables generated successfully!")
+
+    # Forked workers see _shared_df without pickling or copying it; without fork
+    # (e.g. Windows) the tables are built one after another in this process
+    start = time.perf_counter()
+    timings = []
+    if args.jobs > 1 and "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as pool:
+            futures = [pool.submit(run_job, job) for job in todo]
+            for future in as_completed(futures):
+                timings.append(future.result())
+    else:
+        timings = [run_job(job) for job in todo]
+    build_manifest.record_artifacts([name for name, _, _ in timings], inputs, DB_PATH)
+
+    print("\n✅ Summary tables generated successfully!")
     print("Files created:")
-    print("  - data/summary_states.csv")
-    print("  - data/summary_counties.csv") 
-    print("  - data/summary_csas.csv")
-    print("  - data/summary_cities.csv")
+    for name, rows, seconds in sorted(timings):
+        print(f"  - data/{name}: {rows:,} rows in {seconds:.2f}s")
+    print(f"Total build time: {time.perf_counter() - start:.2f}s")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
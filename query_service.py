@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Local JSON service for region statistics, built on the analytics module.
+
+    python query_service.py --port 8765
+
+Endpoints (GET, region_type is one of National/State/County/CSA/City and
+region is a name as listed by /regions; it is ignored for National):
+
+    /regions                                      dropdown names per region type
+    /population?region_type=State&region=Texas    population per NWI level
+    /nwi?region_type=City&region=Austin, Texas    population-weighted mean NWI
+    /breakdown?region_type=CSA&region=...&demographic=Income
+                                                  demographic breakdown by NWI level
+
+Requests are served by asyncio; the pandas/SQLite work runs on a thread pool
+so slow queries don't block other connections. Response bodies are kept in an
+in-process LRU cache keyed by endpoint and parameters, so repeated queries
+(e.g. every dashboard asking for /regions) skip the computation entirely.
+
+Measure latency and throughput under concurrent load with:
+
+    python query_service.py --benchmark --concurrency 32 --requests 2000
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import analytics
+from config import field_dict
+
+
+class QueryError(Exception):
+    """A request that can't be answered; status is the HTTP status to send"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _region(params):
+    """(region_type, region) from the query parameters"""
+    region_type = params.get("region_type", "National")
+    if region_type not in analytics.region_types:
+        raise QueryError(400, f"Unknown region_type {region_type!r}; expected one of {analytics.region_types}")
+    if region_type == "National":
+        return region_type, None
+    region = params.get("region")
+    if not region:
+        raise QueryError(400, f"region is required for region_type {region_type}")
+    return region_type, region
+
+
+def _aggregate(params):
+    """Per-NWI-level sums for the requested region (404 if it has no block groups)"""
+    region_type, region = _region(params)
+    summed = analytics.region_aggregate(region_type, region)
+    if summed.empty:
+        raise QueryError(404, f"No block groups found for {region_type} {region}")
+    return region_type, region, summed
+
+
+def get_regions(params):
+    return analytics.region_lists()
+
+
+def get_population(params):
+    region_type, region, summed = _aggregate(params)
+    population = analytics.population_by_level(summed)
+    return {
+        "region_type": region_type,
+        "region": region,
+        "levels": [
+            {"nwi": int(row[0]), "NWI Level": row[1], "Population": float(row[2])}
+            for row in population[["nwi", "NWI Level", "Population"]].itertuples(index=False)
+        ],
+    }
+
+
+def get_nwi(params):
+    region_type, region, summed = _aggregate(params)
+    return {
+        "region_type": region_type,
+        "region": region,
+        "weighted_average_nwi": float(analytics.weighted_average_nwi(summed)),
+        "population": float(summed["b02001_001e"].sum()),
+    }
+
+
+def get_breakdown(params):
+    demographic = params.get("demographic")
+    if demographic not in field_dict:
+        raise QueryError(400, f"Unknown demographic {demographic!r}; expected one of {list(field_dict)}")
+    region_type, region, summed = _aggregate(params)
+    breakdown = analytics.demographic_breakdown(summed, demographic)
+    return {
+        "region_type": region_type,
+        "region": region,
+        "demographic": demographic,
+        "rows": [
+            {
+                "NWI Level": int(row[0]),
+                "Category": row[1],
+                "Population": float(row[2]),
+                "Level Percentage": float(row[3]),
+                "Category Percentage": float(row[4]),
+            }
+            for row in breakdown.itertuples(index=False)
+        ],
+    }
+
+
+# path -> (handler, query parameters it reads); other parameters are ignored,
+# so they don't split the response cache
+endpoints = {
+    "/regions": (get_regions, ()),
+    "/population": (get_population, ("region_type", "region")),
+    "/nwi": (get_nwi, ("region_type", "region")),
+    "/breakdown": (get_breakdown, ("region_type", "region", "demographic")),
+}
+
+
+def cache_key(path, query):
+    """The endpoint's own parameters from a raw query string, in a canonical order"""
+    _, names = endpoints.get(path, (None, ()))
+    params = dict(parse_qsl(query))
+    if params.get("region_type", "National") == "National":
+        # National ignores region
+        params.pop("region", None)
+    return tuple(sorted((name, value) for name, value in params.items() if name in names))
+
+
+@functools.lru_cache(maxsize=1024)
+def cached_response(path, params):
+    """(status, JSON body) for one request; params is the tuple from cache_key().
+
+    Errors are cached too, since they depend only on the request and the data.
+    """
+    if path not in endpoints:
+        return 404, json.dumps({"error": f"Unknown endpoint {path}", "endpoints": list(endpoints)}).encode()
+    handler, _ = endpoints[path]
+    try:
+        return 200, json.dumps(handler(dict(params))).encode()
+    except QueryError as e:
+        return e.status, json.dumps({"error": str(e)}).encode()
+
+
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+async def handle_connection(reader, writer, executor):
+    """Serve HTTP/1.1 requests on one connection until the client closes it"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            keep_alive = True
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "connection" and value.strip().lower() == "close":
+                    keep_alive = False
+
+            if method != "GET":
+                status, body = 405, json.dumps({"error": "Only GET is supported"}).encode()
+            else:
+                url = urlsplit(target)
+                params = cache_key(url.path, url.query)
+                try:
+                    status, body = await loop.run_in_executor(executor, cached_response, url.path, params)
+                except Exception as e:
+                    status, body = 500, json.dumps({"error": str(e)}).encode()
+
+            writer.write(
+                f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host, port, threads):
+    executor = ThreadPoolExecutor(max_workers=threads)
+    return await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, executor), host, port
+    )
+
+
+async def serve(host, port, threads):
+    server = await start_server(host, port, threads)
+    print(f"Serving region statistics on http://{host}:{port} ({', '.join(endpoints)})")
+    async with server:
+        await server.serve_forever()
+
+
+# ------------------------------- Benchmark ---------------------------------
+
+async def _client(host, port, targets, latencies, statuses):
+    """One keep-alive connection issuing its share of the requests in turn"""
+    reader, writer = await asyncio.open_connection(host, port)
+    for target in targets:
+        start = time.perf_counter()
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+
+def benchmark_targets(count, seed=0):
+    """A random mix of queries over real region names (repeats hit the response cache)"""
+    regions = analytics.region_lists()
+    by_type = {"State": regions["states"], "County": regions["counties"], "CSA": regions["csas"], "City": regions["cities"]}
+    rng = random.Random(seed)
+    targets = []
+    for _ in range(count):
+        region_type = rng.choice(["National"] + [name for name, names in by_type.items() if names])
+        params = {"region_type": region_type}
+        if region_type != "National":
+            params["region"] = rng.choice(by_type[region_type])
+        path = rng.choice(list(endpoints))
+        if path == "/breakdown":
+            params["demographic"] = rng.choice(list(field_dict))
+        targets.append(f"{path}?{urlencode(params)}")
+    return targets
+
+
+async def benchmark(concurrency, requests, threads):
+    """Serve on an ephemeral port and hit it from concurrent clients; print latency and throughput.
+
+    The same request mix is sent twice: first against an empty response cache
+    (every distinct query computed once), then again fully cached.
+    """
+    server = await start_server("127.0.0.1", 0, threads)
+    host, port = server.sockets[0].getsockname()[:2]
+    targets = benchmark_targets(requests)
+    async with server:
+        for label in ["Cold cache", "Warm cache"]:
+            latencies, statuses = [], {}
+            before = cached_response.cache_info()
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                _client(host, port, targets[i::concurrency], latencies, statuses) for i in range(concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+            after = cached_response.cache_info()
+
+            latencies.sort()
+            print(f"{label}: {len(latencies):,} requests from {concurrency} concurrent clients in {elapsed:.2f}s")
+            print(f"  throughput: {len(latencies) / elapsed:,.0f} requests/sec")
+            for name, q in [("p50", 0.50), ("p95", 0.95), ("p99", 0.99)]:
+                print(f"  {name} latency: {latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000:.2f} ms")
+            print(f"  max latency: {latencies[-1] * 1000:.2f} ms")
+            print(f"  status codes: {dict(sorted(statuses.items()))}")
+            print(f"  response cache: {after.hits - before.hits:,} hits, {after.misses - before.misses:,} misses")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--threads", type=int, default=4, help="worker threads for uncached queries")
+    parser.add_argument("--benchmark", action="store_true", help="measure latency/throughput instead of serving")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients for --benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests for --benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        asyncio.run(benchmark(args.concurrency, args.requests, args.threads))
+    else:
+        try:
+            asyncio.run(serve(args.host, args.port, args.threads))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
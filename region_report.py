@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Per-region demographic breakdowns by NWI level for many regions at once.
+
+For every region of a type (or an explicit list) this computes the
+population-weighted average walkability and, for each requested
+config.field_dict demographic, each category's population per NWI level with
+its share of the level and of the category (the numbers behind the Main
+Page's demographic charts):
+
+    python region_report.py City --demographics Income Transportation -o data/city_report.parquet
+    python region_report.py County --regions "County 3" "County 7" -o counties.csv
+
+The block group data is loaded once and shared read-only with a pool of
+forked worker processes; regions are handed out in batches and each finished
+batch is appended to the output (.parquet or .csv) as it arrives, so memory
+use does not grow with the number of regions.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from analytics import load_dataset, region_breakdowns, region_key, region_types, summarize_regions
+from config import field_dict
+
+# Block group frame sorted by region, shared with forked workers (set once in main, never modified)
+_shared_df = None
+# Row offset where each region's block groups start in _shared_df (plus the end)
+_region_bounds = None
+# Report settings, also read by the workers
+_region_type = None
+_demographics = None
+
+
+def report_batch(first, last):
+    """Breakdown rows for regions first..last-1 (positions in the sorted region list)"""
+    chunk = _shared_df.iloc[_region_bounds[first]:_region_bounds[last]]
+    breakdown = region_breakdowns(chunk, "Region", _demographics)
+    averages = summarize_regions(chunk, "Region")[["Region", "Avg Walkability Index"]]
+    breakdown = breakdown.merge(averages, on="Region", how="left")
+    breakdown.insert(0, "Region Type", _region_type)
+    return last - first, breakdown
+
+
+class ReportWriter:
+    """Append DataFrames to one .parquet or .csv file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            self.writer.write_table(table.cast(self.writer.schema))
+        else:
+            df.to_csv(self.path, mode="a" if self.rows else "w", header=not self.rows, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def main():
+    """Compute the breakdowns and stream them to the output file"""
+    global _shared_df, _region_bounds, _demographics, _region_type
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("region_type", choices=region_types)
+    parser.add_argument("--regions", nargs="+", help="only these regions (names as in the app's dropdowns)")
+    parser.add_argument(
+        "--demographics", nargs="+", choices=list(field_dict), default=list(field_dict),
+        help="config.field_dict demographics to break down (default: all)",
+    )
+    parser.add_argument("-o", "--output", default=None, help="output .parquet or .csv file")
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count() or 1,
+        help="worker processes (1 = compute in this process)",
+    )
+    parser.add_argument("--batch-size", type=int, default=100, help="regions per worker task")
+    args = parser.parse_args()
+
+    output = args.output or f"data/report_{args.region_type.lower()}.parquet"
+    if not output.endswith((".parquet", ".csv")):
+        parser.error("--output must end in .parquet or .csv")
+
+    print("Loading block group data...")
+    start = time.perf_counter()
+    df = load_dataset(compact=False)
+    df["Region"] = region_key(df, args.region_type)
+    df = df[df["Region"].notna()]
+    if args.regions:
+        missing = sorted(set(args.regions) - set(df["Region"]))
+        for name in missing:
+            print(f"⚠️  No block groups found for {args.region_type} {name!r}")
+        df = df[df["Region"].isin(args.regions)]
+    if df.empty:
+        print("❌ No regions to report on")
+        sys.exit(1)
+
+    # Sort rows by region so every batch of regions is one contiguous slice
+    codes, regions = pd.factorize(df["Region"], sort=True)
+    order = np.argsort(codes, kind="stable")
+    _shared_df = df.iloc[order].reset_index(drop=True)
+    _region_bounds = np.searchsorted(codes[order], np.arange(len(regions) + 1))
+    _demographics = args.demographics
+    _region_type = args.region_type
+    print(f"Loaded {len(df):,} block groups in {len(regions):,} regions in {time.perf_counter() - start:.1f}s")
+
+    batches = [
+        (first, min(first + args.batch_size, len(regions)))
+        for first in range(0, len(regions), args.batch_size)
+    ]
+    writer = ReportWriter(output)
+    done = 0
+    start = time.perf_counter()
+
+    def record(result):
+        nonlocal done
+        count, breakdown = result
+        writer.write(breakdown)
+        done += count
+        elapsed = time.perf_counter() - start
+        print(f"  {done:,}/{len(regions):,} regions ({done / elapsed:,.0f} regions/sec)")
+
+    # Forked workers see _shared_df without pickling or copying it; without fork
+    # (e.g. Windows) the batches are computed one after another in this process
+    try:
+        if args.jobs > 1 and len(batches) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as pool:
+                futures = [pool.submit(report_batch, first, last) for first, last in batches]
+                for future in as_completed(futures):
+                    record(future.result())
+        else:
+            for first, last in batches:
+                record(report_batch(first, last))
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Saved {writer.rows:,} rows to {output}")
+    print(f"{len(regions):,} regions in {elapsed:.2f}s ({len(regions) / elapsed:,.0f} regions/sec)")
+
+
+if __name__ == "__main__":
+    main()